@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+
+import etl
+
+# ==============================================================================
+# INDICADORES DO DASHBOARD (CALCULADOS SOBRE O CUBO DE AGREGADOS)
+# ==============================================================================
+TAXA_BANCARIA = 0.0233
+ALIQUOTA_DAS = 0.0989
+
+
+def filtrar_cubo(cubo, produtos=None, controles=None):
+    # None = "Selecionar TODOS"; lista vazia = nada selecionado
+    mask = np.ones(len(cubo), dtype=bool)
+    if produtos is not None:
+        mask &= etl.mascara_categorias(cubo['PRODUTO'], produtos)
+    if controles is not None:
+        mask &= etl.mascara_categorias(cubo['CURSO'], controles)
+    return cubo[mask]
+
+
+def mascara_linhas(df, produtos=None, controles=None):
+    # Mesmo filtro aplicado às linhas brutas (apenas para a tabela detalhada)
+    mask = np.ones(len(df), dtype=bool)
+    if produtos is not None:
+        mask &= etl.mascara_categorias(df['PRODUTO'], produtos)
+    if controles is not None:
+        mask &= etl.mascara_categorias(df['CURSO'], controles)
+    return mask
+
+
+def filtrar_linhas(df, produtos=None, controles=None):
+    return df[mascara_linhas(df, produtos, controles)]
+
+
+def calcular_kpis(cubo):
+    validos = cubo[cubo['VALIDO']]
+    por_tipo = validos.groupby('TIPO', observed=False)['VALOR'].sum()
+    receita = float(por_tipo.get('RECEITA', 0.0))
+    despesa = float(por_tipo.get('DESPESA', 0.0))
+
+    lucro = receita - despesa  # Margem Bruta
+    val_taxas_total = receita * TAXA_BANCARIA
+    val_das_total = receita * ALIQUOTA_DAS
+    margem_contribuicao = lucro - val_taxas_total - val_das_total
+    margem = (margem_contribuicao / receita * 100) if receita > 0 else 0
+
+    return {
+        'receita': receita,
+        'despesa': despesa,
+        'lucro': lucro,
+        'taxas': val_taxas_total,
+        'das': val_das_total,
+        'margem_contribuicao': margem_contribuicao,
+        'margem': margem,
+    }
+
+
+def cubo_periodo(serie, inicio=None, fim=None, sem_data=True):
+    # Cubo sem a dimensão MES para os meses [inicio, fim] (None = sem limite), pela
+    # diferença das somas acumuladas; sem_data inclui o grupo de lançamentos NaT.
+    # Mantém as colunas usadas por filtrar_cubo, calcular_kpis e montar_df_chart.
+    lo, hi = serie.faixa(inicio, fim)
+    valor = serie.valor_acum[:, hi] - serie.valor_acum[:, lo]
+    linhas = serie.linhas_acum[:, hi] - serie.linhas_acum[:, lo]
+    if sem_data:
+        valor = valor + serie.sem_data_valor
+        linhas = linhas + serie.sem_data_linhas
+    presentes = linhas > 0
+    return serie.grupos[presentes].assign(VALOR=valor[presentes], LINHAS=linhas[presentes])
+
+
+def tendencia_mensal(serie, inicio=None, fim=None, sem_data=True, produtos=None, controles=None):
+    # Receita e despesa validada mês a mês (MES = NaT para o grupo sem data, por último)
+    lo, hi = serie.faixa(inicio, fim)
+    mask = mascara_linhas(serie.grupos, produtos, controles) & serie.grupos['VALIDO'].to_numpy()
+    receita = (serie.grupos['TIPO'] == 'RECEITA').to_numpy()
+    mensal = np.diff(serie.valor_acum[:, lo:hi + 1], axis=1)
+    df = pd.DataFrame({
+        'MES': serie.meses[lo:hi],
+        'RECEITA': mensal[mask & receita].sum(axis=0),
+        'DESPESA': mensal[mask & ~receita].sum(axis=0),
+    })
+    if sem_data and serie.sem_data_linhas[mask].any():
+        sem = pd.DataFrame({
+            'MES': [pd.NaT],
+            'RECEITA': [serie.sem_data_valor[mask & receita].sum()],
+            'DESPESA': [serie.sem_data_valor[mask & ~receita].sum()],
+        })
+        df = pd.concat([df, sem], ignore_index=True)
+    return df
+
+
+def montar_df_chart(cubo):
+    # Receita e despesa validada por Nº Controle (colunas CURSO, DESPESA, RECEITA)
+    validos = cubo[cubo['VALIDO']]
+    df_chart = validos.groupby(['CURSO', 'TIPO'], observed=True)['VALOR'].sum().unstack(fill_value=0)
+    df_chart.columns = df_chart.columns.astype(str)
+    df_chart.index = df_chart.index.astype(str)
+    df_chart = df_chart.reset_index()
+    if 'RECEITA' not in df_chart.columns: df_chart['RECEITA'] = 0
+    if 'DESPESA' not in df_chart.columns: df_chart['DESPESA'] = 0
+    return df_chart
+
+
+# ==============================================================================
+# TABELA DETALHADA (ORDEM PRÉ-CALCULADA + PAGINAÇÃO)
+# ==============================================================================
+# rótulo -> (colunas, ascending); a primeira é a ordem original da tabela
+ORDENACOES = {
+    'Data (mais recentes)': (['DATA', 'TIPO'], [False, True]),
+    'Data (mais antigas)': (['DATA', 'TIPO'], [True, True]),
+    'Valor (maior)': (['VALOR'], [False]),
+    'Valor (menor)': (['VALOR'], [True]),
+    'Nº Controle': (['CURSO', 'DATA'], [True, False]),
+    'Cliente/Fornecedor': (['ENTIDADE', 'DATA'], [True, False]),
+}
+COLUNAS_DETALHE = {
+    'DATA': 'Data',
+    'CURSO': 'Nº Controle',
+    'CURSO_ORIGINAL': 'Nº Controle (digitado)',
+    'TIPO': 'Tipo',
+    'VALOR': 'Valor',
+    'ENTIDADE': 'Cliente/Fornecedor',
+    'PRODUTO': 'Conta/Serviço',
+}
+
+
+def ordem_detalhe(df, ordenacao):
+    # Posições das linhas na ordem pedida; calculada uma vez por carga de dados
+    colunas, ascending = ORDENACOES[ordenacao]
+    return df[colunas].reset_index(drop=True).sort_values(colunas, ascending=ascending, kind='stable').index.to_numpy()
+
+
+def pagina_detalhe(df, ordem, mask, pagina, tamanho):
+    # Só a página visível é materializada; devolve (df_pagina, total de linhas filtradas)
+    posicoes = ordem[mask[ordem]]
+    inicio = (pagina - 1) * tamanho
+    df_pagina = df.iloc[posicoes[inicio:inicio + tamanho]][list(COLUNAS_DETALHE)]
+    return df_pagina.rename(columns=COLUNAS_DETALHE), len(posicoes)
@@ -0,0 +1,182 @@
+import argparse
+import gc
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook
+
+import analise
+import etl
+
+# ==============================================================================
+# BENCHMARK DO ETL E DO DASHBOARD (OFFLINE, COM PLANILHAS SINTÉTICAS)
+# ==============================================================================
+# Uso: python benchmark.py --linhas 10000 100000 1000000 --abas 24 --saida bench_output.txt
+
+# Variações de cabeçalho que o detector de colunas precisa reconhecer
+LAYOUTS = {
+    'padrao': ['DATA PAGAMENTO', 'Nº CONTROLE PADRONIZADO', 'PRODUTO', 'CLIENTE/FORNECEDOR', 'VALOR'],
+    'alternativo': ['Data', 'Controle', 'Serviço', 'Favorecido', 'Valor Pago'],
+    'legado': ['DATA VENCIMENTO', 'CURSO', 'DESCRIÇÃO', 'VALOR'],
+}
+COLUNAS_EXTRAS = ['OBSERVAÇÃO', 'CATEGORIA', 'CENTRO DE CUSTO', 'FORMA PAGAMENTO', 'PARCELA', 'USUÁRIO']
+PRODUTOS = ['PÓS-GRADUAÇÃO', 'MBA', 'GRADUAÇÃO', 'EXTENSÃO', 'CURSO LIVRE', 'IMERSÃO']
+# Linhas de lixo: caem na lista VALORES_INVALIDOS do ETL
+CONTROLES_INVALIDOS = [None, '', 'NAN', 'N/A', '-', '0', 'NÃO ENCONTRADO', 'NAO_ENCONTRADO']
+
+
+def gerar_planilha(caminho, linhas=10_000, abas=12, layout='padrao', colunas_extras=3,
+                   controles=500, lixo=0.05, abas_ignoradas=2, seed=42):
+    """Grava um xlsx sintético com `linhas` lançamentos divididos entre abas de RECEITA e DESPESA."""
+    rnd = random.Random(seed)
+    cabecalho = LAYOUTS[layout] + COLUNAS_EXTRAS[:colunas_extras]
+    nomes_controle = [f"{25000 + i} {rnd.choice(['PSICOLOGIA', 'DIREITO', 'GESTÃO', 'NUTRIÇÃO'])} {rnd.choice(['UNINGA', 'EAD', 'TURMA A'])}"
+                      for i in range(controles)]
+    por_aba = max(1, linhas // abas)
+    inicio = datetime(2022, 1, 1)
+
+    wb = Workbook(write_only=True)
+    for n in range(abas):
+        receita = n % 2 == 0
+        mes = n // 2
+        ws = wb.create_sheet(f"{'RECEITAS' if receita else 'PAGAMENTOS'} {mes + 1:02d}")
+        ws.append(cabecalho)
+        for i in range(por_aba):
+            controle = rnd.choice(CONTROLES_INVALIDOS) if rnd.random() < lixo else rnd.choice(nomes_controle)
+            if receita:
+                valor = f"R$ {rnd.randint(100, 9999):,},{rnd.randint(0, 99):02d}".replace(',', '.', 1)
+            else:
+                valor = -round(rnd.uniform(10, 3000), 2)
+            data = inicio + timedelta(days=30 * mes + rnd.randint(0, 27))
+            linha = {
+                'padrao': [data, controle, rnd.choice(PRODUTOS), f'PESSOA {i % 900}', valor],
+                'alternativo': [data, controle, rnd.choice(PRODUTOS), f'PESSOA {i % 900}', valor],
+                'legado': [data, controle, f'DESCRIÇÃO {i % 50}', valor],
+            }[layout]
+            ws.append(linha + [f'extra {i % 37}'] * colunas_extras)
+
+    for n in range(abas_ignoradas):
+        ws = wb.create_sheet(f'RESUMO {n + 1}')
+        ws.append(['INDICADOR', 'VALOR'])
+        for i in range(min(por_aba, 1000)):
+            ws.append([f'LINHA {i}', i])
+
+    wb.save(caminho)
+    return caminho
+
+
+# ==============================================================================
+# MEDIÇÃO
+# ==============================================================================
+def medir(resultados, tamanho, etapa, func, *args, memoria=True):
+    gc.collect()
+    if memoria:
+        tracemalloc.start()
+    inicio = time.perf_counter()
+    retorno = func(*args)
+    duracao = time.perf_counter() - inicio
+    pico = None
+    if memoria:
+        pico = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    resultados.append({'linhas': tamanho, 'etapa': etapa, 'segundos': duracao, 'pico_mb': pico and pico / 2**20})
+    return retorno
+
+
+def _processar(lidas):
+    logs = []
+    frames = [etl.processar_aba(nome, df, logs) for nome, df in lidas]
+    return [f for f in frames if f is not None]
+
+
+def _render_frames(df_chart):
+    # Mesmo preparo dos gráficos do Dashboard (top 10 por volume e por receita)
+    df_chart = df_chart.assign(VOLUME=df_chart['RECEITA'] + df_chart['DESPESA'])
+    df_perf = df_chart.sort_values('VOLUME', ascending=False).head(10)
+    df_rank = df_chart.sort_values('RECEITA', ascending=True).tail(10)
+    df_rank = df_rank.assign(TEXTO_BRL=df_rank['RECEITA'].map(lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")))
+    return df_perf, df_rank
+
+
+def executar(tamanho, args, resultados):
+    caminho = os.path.join(args.dir, f'bench_{tamanho}_{args.abas}_{args.layout}_{args.colunas_extras}.xlsx')
+    if not os.path.exists(caminho):
+        print(f'Gerando {caminho}...', flush=True)
+        gerar_planilha(caminho, linhas=tamanho, abas=args.abas, layout=args.layout,
+                       colunas_extras=args.colunas_extras, controles=args.controles)
+    with open(caminho, 'rb') as f:
+        conteudo = f.read()
+
+    def m(etapa, func, *a):
+        return medir(resultados, tamanho, etapa, func, *a, memoria=not args.sem_memoria)
+
+    relevantes = [n for n in etl.nomes_abas(conteudo) if etl.classificar_aba(n)]
+    m('etl: fingerprints', etl.fingerprints_abas, conteudo, set(relevantes))
+    lidas = m('etl: leitura xlsx', lambda: list(etl.ler_abas(conteudo, relevantes)))
+    frames = m('etl: limpeza', _processar, lidas)
+    df = m('etl: concat + backfill', etl.montar_dataset, frames)
+    del lidas, frames
+
+    ingestao = etl.IngestaoIncremental(workers=args.workers)
+    m('etl: carga completa', ingestao.carregar, conteudo)
+    m('etl: recarga sem mudança', ingestao.carregar, conteudo)
+
+    cubo = m('cubo: montagem', etl.montar_cubo, df)
+    produtos = etl.valores_presentes(cubo['PRODUTO'])[:2]
+    controles = etl.valores_presentes(cubo['CURSO'])
+    controles = controles[: max(1, len(controles) // 10)]
+
+    m('filtros: listas', lambda: (etl.valores_presentes(cubo['PRODUTO']), etl.valores_presentes(cubo['CURSO'])))
+    cubo_filtrado = m('filtros: cubo', analise.filtrar_cubo, cubo, produtos, controles)
+    m('filtros: linhas', analise.filtrar_linhas, df, produtos, controles)
+    m('kpis: todos', analise.calcular_kpis, cubo)
+    m('kpis: filtrado', analise.calcular_kpis, cubo_filtrado)
+    serie = m('período: série mensal', etl.SerieMensal, cubo)
+    indice = m('período: índice de datas', etl.IndiceDatas, df)
+    mes = serie.meses[len(serie.meses) // 2] if len(serie.meses) else None
+    m('kpis: um mês', lambda: analise.calcular_kpis(analise.cubo_periodo(serie, mes, mes, False)))
+    m('filtros: linhas de um mês', indice.mascara, mes, mes, False)
+    m('gráficos: tendência mensal', analise.tendencia_mensal, serie)
+    df_chart = m('gráficos: df_chart', analise.montar_df_chart, cubo)
+    m('gráficos: top 10', _render_frames, df_chart)
+
+
+def formatar(resultados):
+    linhas = [f"{'linhas':>10}  {'etapa':<28} {'tempo (s)':>10} {'pico (MB)':>10}"]
+    for r in resultados:
+        pico = '-' if r['pico_mb'] is None else f"{r['pico_mb']:.1f}"
+        linhas.append(f"{r['linhas']:>10}  {r['etapa']:<28} {r['segundos']:>10.4f} {pico:>10}")
+    return '\n'.join(linhas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark offline do ETL e do Dashboard.')
+    parser.add_argument('--linhas', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--abas', type=int, default=24, help='abas de RECEITA/DESPESA (alternadas)')
+    parser.add_argument('--layout', choices=sorted(LAYOUTS), default='padrao')
+    parser.add_argument('--colunas-extras', type=int, default=3)
+    parser.add_argument('--controles', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--dir', default=os.path.join(tempfile.gettempdir(), 'ohana_bench'))
+    parser.add_argument('--sem-memoria', action='store_true', help='não usa tracemalloc (tempos mais fiéis)')
+    parser.add_argument('--saida', help='também grava o relatório neste arquivo')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.dir, exist_ok=True)
+    resultados = []
+    for tamanho in args.linhas:
+        executar(tamanho, args, resultados)
+
+    relatorio = formatar(resultados)
+    print(relatorio)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            f.write(relatorio + '\n')
+
+
+if __name__ == '__main__':
+    main()
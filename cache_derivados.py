@@ -0,0 +1,106 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# CACHE COMPARTILHADO DE RESULTADOS DERIVADOS (LRU COM TETO DE MEMÓRIA)
+# ==============================================================================
+# Um único cache por processo para resultados que dependem só da versão dos
+# dados e da seleção de filtros (cubos filtrados, listas de produtos/controles,
+# KPIs e frames dos gráficos): dez pessoas com "Selecionar TODOS" calculam uma
+# vez só. Os valores guardados são somente leitura para quem os recebe.
+LIMITE_MB = float(os.environ.get('OHANA_CACHE_DERIVADOS_MB', '256'))
+
+
+def chave_selecao(valores):
+    # None = "Selecionar TODOS"; a ordem da seleção não muda o resultado
+    return None if valores is None else tuple(sorted(set(valores), key=str))
+
+
+def tamanho_bytes(valor):
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        return int(valor.memory_usage(deep=True).sum()) if isinstance(valor, pd.DataFrame) else int(valor.memory_usage(deep=True))
+    if hasattr(valor, 'to_plotly_json'):
+        # Figuras do Plotly: mede o dicionário com os dados dos traços
+        return tamanho_bytes(valor.to_plotly_json())
+    if isinstance(valor, np.ndarray):
+        return int(valor.nbytes)
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(tamanho_bytes(k) + tamanho_bytes(v) for k, v in valor.items())
+    if isinstance(valor, (list, tuple, set, frozenset)):
+        return sys.getsizeof(valor) + sum(tamanho_bytes(v) for v in valor)
+    return sys.getsizeof(valor)
+
+
+class CacheDerivados:
+    # Entradas valem para uma única versão dos dados: definir_versao() com uma
+    # versão nova descarta tudo de uma vez (sob o lock), e pedidos de uma versão
+    # que não é a atual (um rerun que começou antes da troca) são calculados
+    # sem entrar no cache.
+
+    def __init__(self, limite_mb=None):
+        self.limite_bytes = int((LIMITE_MB if limite_mb is None else limite_mb) * 2**20)
+        self._lock = threading.Lock()
+        self._itens = OrderedDict()  # chave -> (valor, bytes)
+        self._versao = None
+        self.bytes = 0
+        self.acertos = 0
+        self.faltas = 0
+        self.despejos = 0
+        self.invalidacoes = 0
+
+    def definir_versao(self, versao):
+        with self._lock:
+            if versao == self._versao:
+                return
+            self._versao = versao
+            self._itens = OrderedDict()
+            self.bytes = 0
+            self.invalidacoes += 1
+
+    def obter(self, versao, chave, calcular):
+        with self._lock:
+            atual = versao == self._versao
+            if atual and chave in self._itens:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return self._itens[chave][0]
+            self.faltas += 1
+
+        # Calcula fora do lock: sessões com seleções diferentes não se bloqueiam
+        valor = calcular()
+        if atual:
+            self._guardar(versao, chave, valor)
+        return valor
+
+    def _guardar(self, versao, chave, valor):
+        tamanho = tamanho_bytes(valor)
+        if tamanho > self.limite_bytes:
+            return
+        with self._lock:
+            if versao != self._versao or chave in self._itens:
+                return
+            self._itens[chave] = (valor, tamanho)
+            self.bytes += tamanho
+            while self.bytes > self.limite_bytes:
+                _, (_, liberado) = self._itens.popitem(last=False)
+                self.bytes -= liberado
+                self.despejos += 1
+
+    def estatisticas(self):
+        with self._lock:
+            consultas = self.acertos + self.faltas
+            return {
+                'itens': len(self._itens),
+                'memoria_mb': round(self.bytes / 2**20, 2),
+                'limite_mb': round(self.limite_bytes / 2**20, 2),
+                'acertos': self.acertos,
+                'faltas': self.faltas,
+                'taxa_acerto': round(self.acertos / consultas, 3) if consultas else None,
+                'despejos': self.despejos,
+                'invalidacoes': self.invalidacoes,
+            }
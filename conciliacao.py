@@ -0,0 +1,197 @@
+import math
+import os
+import re
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from normalizacao import aplicar_por_valor_unico, extrair_id, gerar_sugestao, normalizar_texto
+
+# ==============================================================================
+# CONCILIAÇÃO DE Nº CONTROLE (DESPESA -> RECEITA)
+# ==============================================================================
+# Despesas cujo Nº Controle não existe nas receitas ("25016 PSICOLOGIA 2" vs
+# "25016 PSICOLOGIA") perdem o PRODUTO e saem da margem. Antes do backfill,
+# cada código distinto sem par exato é resolvido assim:
+#   1. ID numérico à esquerda: se identifica uma única receita, é ela;
+#   2. sem ID: índice invertido de trigramas sobre os nomes normalizados das
+#      receitas (sem o ID e sem sufixos numéricos), aceitando o melhor
+#      Jaccard >= limiar;
+#   3. ID repetido em várias receitas: desempata pela mesma similaridade.
+# Empates e IDs sem receita ficam sem correspondência (nunca chuta).
+LIMIAR_SIMILARIDADE = float(os.environ.get('OHANA_CONCILIACAO_LIMIAR', '0.7'))
+TAMANHO_NGRAMA = 3
+_RE_ID_INICIAL = re.compile(r'^\s*\d+(?=\s|$)')
+
+COLUNAS_RELATORIO = ['Nº Controle (despesa)', 'Nº Controle (receita)', 'Critério', 'Similaridade', 'Linhas']
+
+
+def ngramas(texto, n=TAMANHO_NGRAMA):
+    texto = f' {texto} '
+    return frozenset(texto[i:i + n] for i in range(max(1, len(texto) - n + 1)))
+
+
+def jaccard(a, b):
+    comum = len(a & b)
+    return comum / (len(a) + len(b) - comum) if comum else 0.0
+
+
+class IndiceNgramas:
+    # Cada n-grama aponta para as posições (ordenadas) dos textos que o contêm.
+    # A busca usa filtro de prefixo e de tamanho: com Jaccard >= limiar, o
+    # candidato precisa ter ao menos um dos (|q| - ceil(limiar * |q|) + 1)
+    # n-gramas mais raros da consulta e entre limiar*|q| e |q|/limiar n-gramas.
+    # Só as listas curtas são percorridas; nunca se compara todos contra todos.
+
+    def __init__(self, textos):
+        self._id_grama = {}
+        grams_por_texto = [[self._id_grama.setdefault(g, len(self._id_grama)) for g in ngramas(t)] for t in textos]
+        self.tamanhos = np.array([len(g) for g in grams_por_texto], dtype=np.int64)
+        # Os n-gramas de cada texto em sequência (CSR) e, por n-grama, a lista de textos
+        self._grams = np.array([g for grams in grams_por_texto for g in grams], dtype=np.int32)
+        self._inicio = np.concatenate([[0], np.cumsum(self.tamanhos)[:-1]]).astype(np.int64)
+        textos_por_grama = np.repeat(np.arange(len(grams_por_texto), dtype=np.int32), self.tamanhos)
+        ordem = np.argsort(self._grams, kind='stable')
+        limites = np.searchsorted(self._grams[ordem], np.arange(len(self._id_grama) + 1))
+        self._postings = np.split(textos_por_grama[ordem], limites[1:-1])
+
+    def buscar(self, texto, limiar):
+        grams = ngramas(texto)
+        ids = [self._id_grama[g] for g in grams if g in self._id_grama]
+        # n-gramas ausentes do índice são os mais raros de todos e já ocupam o prefixo
+        prefixo = len(grams) - math.ceil(limiar * len(grams) - 1e-9) + 1 - (len(grams) - len(ids))
+        if prefixo <= 0 or not ids:
+            return []
+        raros = sorted(ids, key=lambda g: len(self._postings[g]))[:prefixo]
+        marcados = np.zeros(len(self.tamanhos), dtype=bool)
+        for g in raros:
+            marcados[self._postings[g]] = True
+        candidatos = np.flatnonzero(marcados)
+        tamanhos = self.tamanhos[candidatos]
+        filtro = (tamanhos >= limiar * len(grams) - 1e-9) & (tamanhos * limiar <= len(grams) + 1e-9)
+        candidatos, tamanhos = candidatos[filtro], tamanhos[filtro]
+        if not len(candidatos):
+            return []
+
+        # Interseção de todos os candidatos de uma vez sobre os n-gramas em CSR
+        fim = np.cumsum(tamanhos)
+        posicoes = np.repeat(self._inicio[candidatos] - (fim - tamanhos), tamanhos) + np.arange(fim[-1])
+        na_consulta = np.zeros(len(self._id_grama), dtype=bool)
+        na_consulta[ids] = True
+        acertos = na_consulta[self._grams[posicoes]]
+        comum = np.add.reduceat(acertos.astype(np.int32), fim - tamanhos)
+        similaridade = comum / (len(grams) + tamanhos - comum)
+        aceitos = np.flatnonzero(similaridade >= limiar)
+        return sorted(((float(similaridade[k]), int(candidatos[k])) for k in aceitos), reverse=True)
+
+
+def chave_nome(texto):
+    # Nome sem o ID à esquerda e sem sufixos numéricos: "25016 Psicologia 2" -> "psicologia"
+    return normalizar_texto(gerar_sugestao(_RE_ID_INICIAL.sub('', str(texto))))
+
+
+class Conciliador:
+    # O índice é refeito só quando o conjunto de Nº Controle de receita muda; as
+    # resoluções ficam memorizadas por código de despesa entre as cargas.
+
+    def __init__(self, limiar=None):
+        self.limiar = LIMIAR_SIMILARIDADE if limiar is None else limiar
+        self._receitas = None
+        self._memo = {}
+        self.relatorio = pd.DataFrame(columns=COLUNAS_RELATORIO)
+
+    def _preparar(self, receitas):
+        if receitas == self._receitas:
+            return
+        self._receitas = receitas
+        self._codigos = sorted(receitas)
+        serie = pd.Series(self._codigos, dtype=object)
+        self._por_id = defaultdict(list)
+        for codigo, id_ in zip(self._codigos, extrair_id(serie)):
+            if id_ is not None:
+                self._por_id[id_].append(codigo)
+        # Um registro no índice por nome distinto (vários IDs costumam repetir o mesmo nome)
+        self._por_nome = defaultdict(list)
+        for codigo, nome in zip(self._codigos, aplicar_por_valor_unico(serie, chave_nome)):
+            self._por_nome[nome].append(codigo)
+        self._nomes = list(self._por_nome)
+        self._indice = IndiceNgramas(self._nomes)
+        self._memo = {}
+
+    @staticmethod
+    def _melhor(achados):
+        # achados: [(similaridade, [códigos com esse nome])] em ordem decrescente
+        if not achados:
+            return None, 'sem correspondência', None
+        similaridade, codigos = achados[0]
+        if len(codigos) > 1 or (len(achados) > 1 and achados[1][0] == similaridade):
+            return None, 'ambíguo', round(similaridade, 3)
+        return codigos[0], 'similaridade', round(similaridade, 3)
+
+    def resolver(self, codigo):
+        if codigo in self._memo:
+            return self._memo[codigo]
+        id_ = extrair_id(codigo)
+        mesmo_id = self._por_id.get(id_, []) if id_ else []
+        if len(mesmo_id) == 1:
+            resultado = (mesmo_id[0], 'ID', None)
+        elif id_ and not mesmo_id:
+            resultado = (None, 'sem correspondência', None)
+        elif mesmo_id:
+            # ID repetido em várias receitas: desempata pelo nome entre elas
+            grams = ngramas(chave_nome(codigo))
+            por_nome = defaultdict(list)
+            for c in mesmo_id:
+                por_nome[chave_nome(c)].append(c)
+            achados = ((jaccard(grams, ngramas(nome)), cs) for nome, cs in por_nome.items())
+            resultado = self._melhor(sorted(((s, cs) for s, cs in achados if s >= self.limiar), reverse=True))
+        else:
+            achados = self._indice.buscar(chave_nome(codigo), self.limiar)
+            resultado = self._melhor([(s, self._por_nome[self._nomes[i]]) for s, i in achados])
+        self._memo[codigo] = resultado
+        return resultado
+
+    def conciliar(self, df):
+        """Reescreve o CURSO das despesas conciliadas (no próprio df) e monta o relatório."""
+        if df.empty:
+            self.relatorio = pd.DataFrame(columns=COLUNAS_RELATORIO)
+            return df
+        despesa = (df['TIPO'] == 'DESPESA').to_numpy()
+        receitas = frozenset(df.loc[~despesa, 'CURSO'].unique())
+        cursos_despesa = df.loc[despesa, 'CURSO']
+        orfas = cursos_despesa[~cursos_despesa.isin(receitas)].value_counts(sort=False)
+        if orfas.empty:
+            self.relatorio = pd.DataFrame(columns=COLUNAS_RELATORIO)
+            return df
+
+        self._preparar(receitas)
+        linhas = []
+        mapa = {}
+        for codigo, n in orfas.items():
+            destino, criterio, similaridade = self.resolver(codigo)
+            linhas.append((codigo, destino, criterio, similaridade, n))
+            if destino is not None:
+                mapa[codigo] = destino
+
+        # Só o código das agregações muda; o digitado continua em CURSO_ORIGINAL
+        if mapa:
+            df.loc[despesa, 'CURSO'] = cursos_despesa.map(mapa).fillna(cursos_despesa)
+        self.relatorio = (
+            pd.DataFrame(linhas, columns=COLUNAS_RELATORIO)
+            .sort_values(['Critério', 'Linhas'], ascending=[True, False], ignore_index=True)
+        )
+        return df
+
+    def resumo(self):
+        # Linha de log só quando algo foi reatribuído; os órfãos aparecem no relatório
+        conciliadas = self.relatorio['Nº Controle (receita)'].notna()
+        if not conciliadas.any():
+            return []
+        contagem = self.relatorio['Critério'].value_counts()
+        return [
+            f"🔗 Conciliação de Nº Controle: {contagem.get('ID', 0)} por ID, "
+            f"{contagem.get('similaridade', 0)} por similaridade, "
+            f"{int((~conciliadas).sum())} sem correspondência "
+            f"({int(self.relatorio.loc[conciliadas, 'Linhas'].sum())} linhas de despesa reatribuídas)."
+        ]
@@ -0,0 +1,48 @@
+import io
+from datetime import datetime
+
+import pytest
+from openpyxl import Workbook
+
+
+# ==============================================================================
+# FIXTURES COMPARTILHADAS PELOS TESTES (PLANILHAS EM MEMÓRIA)
+# ==============================================================================
+def _gerar_xlsx(abas):
+    """Monta um xlsx em memória a partir de {nome_aba: [linha_cabecalho, *linhas]}."""
+    wb = Workbook()
+    wb.remove(wb.active)
+    for nome, linhas in abas.items():
+        ws = wb.create_sheet(nome)
+        for linha in linhas:
+            ws.append(linha)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def gerar_xlsx():
+    return _gerar_xlsx
+
+
+@pytest.fixture
+def abas():
+    return {
+        'RECEITAS JAN': [
+            ['DATA PAGAMENTO', 'Nº CONTROLE PADRONIZADO', 'PRODUTO', 'CLIENTE', 'VALOR'],
+            [datetime(2024, 1, 5), '25016 PSICOLOGIA UNINGA', 'Pós', 'Ana', 'R$ 1.500,50'],
+            [datetime(2024, 1, 9), 25017.0, 'MBA', 'Bia', 'R$ 300,00'],
+            [datetime(2024, 1, 9), 'N/A', 'MBA', 'Caio', 'R$ 99,00'],
+        ],
+        'PAGAMENTOS JAN': [
+            ['DATA', 'CONTROLE', 'FORNECEDOR', 'VALOR'],
+            [datetime(2024, 1, 20), '25016 PSICOLOGIA UNINGA', 'Gráfica', -200.0],
+            [datetime(2024, 1, 21), '99999 SEM RECEITA', 'Hotel', -50.0],
+        ],
+        'DESPESAS VAZIA': [
+            ['DATA', 'CONTROLE', 'VALOR'],
+            [datetime(2024, 1, 1), '-', 10],
+        ],
+        'RESUMO': [['QUALQUER', 'COISA'], [1, 2]],
+    }
@@ -0,0 +1,780 @@
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from openpyxl.reader.excel import ExcelReader
+from openpyxl.styles.stylesheet import apply_stylesheet
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet._reader import WorkSheetParser
+from pandas.io.parsers import TextParser
+
+from conciliacao import Conciliador
+from instrumentacao import etapa
+from normalizacao import limpar_valor, normalizar_controle, normalizar_maiusculo
+
+# ==============================================================================
+# ETL (FILTRAGEM DE LIXO E MAPA DE DADOS) - SEM DEPENDÊNCIA DO STREAMLIT
+# ==============================================================================
+SHEET_ID = '19QVv-DBUIHoFx1mn5nL1NZUcHyPnzGLZfgCb9UH0ARo'
+URL_PLANILHA = f'https://docs.google.com/spreadsheets/d/{SHEET_ID}/export?format=xlsx'
+
+# LISTA DE EXCLUSÃO (CRÍTICO)
+VALORES_INVALIDOS = [
+    '', 'NAN', 'NAT', 'NONE', 'NULL', '0', 'N/A', '-', 'nan',
+    'NÃO ENCONTRADO', 'NAO ENCONTRADO', 'NAO_ENCONTRADO'
+]
+
+# CURSO é o Nº Controle usado nas agregações (já conciliado); CURSO_ORIGINAL, o digitado na planilha
+COLUNAS_FINAIS = ['CURSO', 'CURSO_ORIGINAL', 'PRODUTO', 'ENTIDADE', 'VALOR', 'DATA', 'TIPO']
+COLUNAS_CATEGORICAS = ['CURSO', 'CURSO_ORIGINAL', 'PRODUTO', 'ENTIDADE', 'TIPO']
+# Ordem alfabética: ordenar pelo código dá o mesmo resultado que ordenar o texto
+TIPOS = ['DESPESA', 'RECEITA']
+
+
+def classificar_aba(sheet_name):
+    s_name_upper = sheet_name.upper()
+    if 'RECEB' in s_name_upper or 'RECEIT' in s_name_upper:
+        return 'RECEITA'
+    if 'PAGA' in s_name_upper or 'DESP' in s_name_upper or 'SAIDA' in s_name_upper:
+        return 'DESPESA'
+    return None
+
+
+def detectar_colunas(colunas):
+    col_valor = next((c for c in colunas if c == 'VALOR'), None) or \
+                next((c for c in colunas if 'VALOR' in c), None)
+
+    col_curso = next((c for c in colunas if "CONTROLE" in c and "PADRONIZADO" in c), None)
+    if not col_curso:
+        col_curso = next((c for c in colunas if "CONTROLE" in c), None) or \
+                    next((c for c in colunas if "CURSO" in c), None)
+
+    col_produto = next((c for c in colunas if "PRODUTO" in c or "SERVIÇO" in c), None)
+
+    col_entidade = next((c for c in colunas if "CLIENTE" in c or "FORNECEDOR" in c or "FAVORECIDO" in c), None)
+    if not col_entidade:
+        col_entidade = next((c for c in colunas if "NOME" in c or "DESCRI" in c), None)
+
+    col_data = next((c for c in colunas if 'PAGAMENTO' in c and 'DATA' in c), None) or \
+               next((c for c in colunas if 'DATA' in c), None)
+
+    return {
+        'valor': col_valor, 'curso': col_curso, 'produto': col_produto,
+        'entidade': col_entidade, 'data': col_data,
+    }
+
+
+def processar_aba(sheet_name, df, logs):
+    # Devolve o df_temp limpo da aba, ou None se ela não tiver dados aproveitáveis
+    tipo_lancamento = classificar_aba(sheet_name)
+    if not tipo_lancamento:
+        return None
+
+    df = df.set_axis(df.columns.astype(str).str.strip().str.upper(), axis=1)
+    cols = detectar_colunas(df.columns)
+    col_valor, col_curso = cols['valor'], cols['curso']
+    col_produto, col_entidade, col_data = cols['produto'], cols['entidade'], cols['data']
+
+    if not (col_valor and col_curso):
+        return None
+
+    # Normalização feita uma vez por valor distinto (ver normalizacao.py)
+    df_subset = df
+    df_subset['TEMP_CURSO'] = normalizar_controle(df_subset[col_curso])
+
+    if col_produto:
+        df_subset['TEMP_PRODUTO'] = normalizar_maiusculo(df_subset[col_produto])
+    else:
+        df_subset['TEMP_PRODUTO'] = 'NÃO INFORMADO'
+
+    if col_entidade:
+        df_subset['TEMP_ENTIDADE'] = normalizar_maiusculo(df_subset[col_entidade])
+    else:
+        df_subset['TEMP_ENTIDADE'] = 'NÃO INFORMADO'
+
+    mask_invalid = df_subset['TEMP_CURSO'].isin(VALORES_INVALIDOS)
+    df_subset = df_subset[~mask_invalid]
+
+    if df_subset.empty:
+        logs.append(f"⚠️ Aba '{sheet_name}' ignorada: Registros sem 'Nº Controle' válido.")
+        return None
+
+    df_temp = pd.DataFrame()
+    df_temp['CURSO'] = df_subset['TEMP_CURSO']
+    df_temp['CURSO_ORIGINAL'] = df_subset['TEMP_CURSO']
+    df_temp['PRODUTO'] = df_subset['TEMP_PRODUTO']
+    df_temp['ENTIDADE'] = df_subset['TEMP_ENTIDADE']
+    df_temp['VALOR'] = limpar_valor(df_subset[col_valor]).abs().astype('float64')
+
+    if col_data:
+        df_temp['DATA'] = pd.to_datetime(df_subset[col_data], errors='coerce')
+    else:
+        df_temp['DATA'] = pd.NaT
+
+    df_temp['TIPO'] = tipo_lancamento
+    return df_temp
+
+
+def montar_dataset(df_list, conciliador=None):
+    with etapa('concat', abas=len(df_list)) as reg:
+        df_final = pd.concat(df_list, ignore_index=True) if df_list else pd.DataFrame()
+        reg['linhas'] = len(df_final)
+
+    # Nº Controle de despesa com erro de digitação passa a apontar para a receita
+    with etapa('conciliação de controles') as reg:
+        conciliador = Conciliador() if conciliador is None else conciliador
+        df_final = conciliador.conciliar(df_final)
+        reg['codigos_orfaos'] = len(conciliador.relatorio)
+
+    # Despesas herdam o PRODUTO da receita do mesmo Nº Controle
+    if not df_final.empty:
+        with etapa('backfill mapa_produtos'):
+            mapa_produtos = (
+                df_final[df_final['TIPO'] == 'RECEITA']
+                .drop_duplicates('CURSO')
+                .set_index('CURSO')['PRODUTO']
+                .to_dict()
+            )
+            mask_update = (df_final['TIPO'] == 'DESPESA')
+            df_final.loc[mask_update, 'PRODUTO'] = df_final.loc[mask_update, 'CURSO'].map(mapa_produtos).fillna('OUTROS / INDEFINIDO')
+        with etapa('codificação categórica'):
+            df_final = codificar_categorias(df_final)
+
+    return df_final
+
+
+# ==============================================================================
+# CODIFICAÇÃO CATEGÓRICA (FILTROS E AGREGAÇÕES SOBRE CÓDIGOS INTEIROS)
+# ==============================================================================
+def codificar_categorias(df):
+    # Categorias em ordem alfabética: o índice é estável entre cargas com os mesmos valores
+    df = df.copy()
+    for col in COLUNAS_CATEGORICAS:
+        categorias = TIPOS if col == 'TIPO' else sorted(df[col].unique())
+        df[col] = pd.Categorical(df[col], categories=categorias)
+    return df
+
+
+def mascara_categorias(serie, valores):
+    codigos = serie.cat.categories.get_indexer(list(valores))
+    return np.isin(serie.cat.codes.to_numpy(), codigos[codigos >= 0])
+
+
+def valores_presentes(serie):
+    # Categorias que aparecem na série, já em ordem alfabética (sem ordenar texto)
+    contagem = np.bincount(serie.cat.codes.to_numpy() + 1, minlength=len(serie.cat.categories) + 1)
+    return serie.cat.categories[contagem[1:] > 0].tolist()
+
+
+# ==============================================================================
+# CUBO DE AGREGADOS (PRODUTO x CURSO x TIPO x MÊS)
+# ==============================================================================
+COLUNAS_CUBO = ['PRODUTO', 'CURSO', 'TIPO', 'MES', 'VALIDO', 'VALOR', 'LINHAS']
+
+
+def montar_cubo(df):
+    # Uma linha por PRODUTO x CURSO x TIPO x MÊS (MES = NaT para lançamentos sem data).
+    # VALIDO já aplica a regra "despesa só conta se o Nº Controle tem receita";
+    # as despesas não validadas ficam no cubo apenas para alimentar a lista de controles.
+    if df.empty:
+        return pd.DataFrame(columns=COLUNAS_CUBO)
+
+    receita = (df['TIPO'] == 'RECEITA').to_numpy()
+    cursos_receita = valores_presentes(df.loc[receita, 'CURSO'])
+    chaves = pd.DataFrame({
+        'PRODUTO': df['PRODUTO'],
+        'CURSO': df['CURSO'],
+        'TIPO': df['TIPO'],
+        'MES': df['DATA'].dt.to_period('M').dt.to_timestamp(),
+        'VALIDO': receita | mascara_categorias(df['CURSO'], cursos_receita),
+        'VALOR': df['VALOR'],
+    })
+    return (
+        chaves.groupby(['PRODUTO', 'CURSO', 'TIPO', 'MES', 'VALIDO'], observed=True, dropna=False)
+        .agg(VALOR=('VALOR', 'sum'), LINHAS=('VALOR', 'size'))
+        .reset_index()
+    )
+
+
+# ==============================================================================
+# ÍNDICE TEMPORAL (ORDEM POR DATA + SOMAS MENSAIS ACUMULADAS)
+# ==============================================================================
+def _inicio_mes(data):
+    return pd.Timestamp(data).to_period('M').to_timestamp()
+
+
+class IndiceDatas:
+    # Posições das linhas ordenadas por DATA, calculadas uma vez por carga: um
+    # intervalo de meses vira uma fatia achada por busca binária. Linhas sem
+    # data (NaT) ficam no fim da ordem e formam um grupo à parte.
+
+    def __init__(self, df):
+        datas = df['DATA'].to_numpy() if len(df) else np.array([], dtype='datetime64[ns]')
+        self.ordem = np.argsort(datas, kind='stable')  # NaT vai para o fim
+        self.datas = datas[self.ordem]
+        self.com_data = int((~np.isnat(self.datas)).sum())
+
+    def mascara(self, inicio=None, fim=None, sem_data=True):
+        datadas = self.datas[:self.com_data]
+        lo = 0 if inicio is None else int(np.searchsorted(datadas, np.datetime64(_inicio_mes(inicio)), 'left'))
+        hi = self.com_data if fim is None else int(np.searchsorted(datadas, np.datetime64(_inicio_mes(fim) + pd.offsets.MonthBegin(1)), 'left'))
+        mask = np.zeros(len(self.ordem), dtype=bool)
+        mask[self.ordem[lo:hi]] = True
+        if sem_data:
+            mask[self.ordem[self.com_data:]] = True
+        return mask
+
+
+GRUPOS_SERIE = ['PRODUTO', 'CURSO', 'TIPO', 'VALIDO']
+
+
+class SerieMensal:
+    # Somas acumuladas mês a mês de cada grupo PRODUTO x CURSO x TIPO x VALIDO do
+    # cubo (meses contínuos do primeiro ao último). O total de qualquer intervalo
+    # sai de uma subtração entre duas colunas, sem varrer linhas nem o cubo.
+    # Lançamentos sem data ficam em sem_data_valor / sem_data_linhas.
+
+    def __init__(self, cubo):
+        grupos = cubo.groupby(GRUPOS_SERIE, observed=True, sort=True)
+        grupo = grupos.ngroup().to_numpy()
+        self.grupos = grupos.size().reset_index()[GRUPOS_SERIE]
+
+        mes = cubo['MES']
+        com_data = mes.notna().to_numpy()
+        self.meses = (
+            pd.date_range(mes.min(), mes.max(), freq='MS') if com_data.any() else pd.DatetimeIndex([])
+        )
+        valor = np.zeros((len(self.grupos), len(self.meses)))
+        linhas = np.zeros((len(self.grupos), len(self.meses)), dtype=np.int64)
+        # Cada (grupo, mês) aparece uma única vez no cubo: atribuição direta
+        coluna = self.meses.searchsorted(mes[com_data])
+        valor[grupo[com_data], coluna] = cubo['VALOR'].to_numpy()[com_data]
+        linhas[grupo[com_data], coluna] = cubo['LINHAS'].to_numpy()[com_data]
+        self.valor_acum = np.concatenate([np.zeros((len(valor), 1)), valor.cumsum(axis=1)], axis=1)
+        self.linhas_acum = np.concatenate([np.zeros((len(linhas), 1), dtype=np.int64), linhas.cumsum(axis=1)], axis=1)
+
+        self.sem_data_valor = np.zeros(len(self.grupos))
+        self.sem_data_linhas = np.zeros(len(self.grupos), dtype=np.int64)
+        self.sem_data_valor[grupo[~com_data]] = cubo['VALOR'].to_numpy()[~com_data]
+        self.sem_data_linhas[grupo[~com_data]] = cubo['LINHAS'].to_numpy()[~com_data]
+
+    def faixa(self, inicio=None, fim=None):
+        # Colunas [lo, hi) de self.meses cobertas pelo intervalo (meses inclusivos)
+        lo = 0 if inicio is None else int(self.meses.searchsorted(_inicio_mes(inicio), 'left'))
+        hi = len(self.meses) if fim is None else int(self.meses.searchsorted(_inicio_mes(fim), 'right'))
+        return lo, max(lo, hi)
+
+
+# ==============================================================================
+# LEITOR XLSX EM STREAMING (SÓ AS COLUNAS USADAS)
+# ==============================================================================
+# O iter_rows() do openpyxl monta uma célula para cada <c> da aba, usada ou não,
+# e o load_workbook percorre todas as abas sem <dimension> só para medi-las.
+# Aqui o workbook é aberto sem ler as abas, o cabeçalho define as colunas usadas
+# e o XML da aba passa em blocos por uma regex (em C) que tira as demais células
+# antes do parser do openpyxl, que então só converte as colunas usadas.
+_RE_SEM_REFERENCIA = re.compile(rb'<(?:c|row)(?=[\s/>])(?![^>]*\sr=")')
+_RE_VALOR_CELULA = re.compile(rb'<v>[^<]|<is[\s>]')
+_RE_NUMERO_LINHA = re.compile(rb'<row\b[^>]*?\sr="(\d+)"')
+BLOCO_XML = 2**18
+
+
+def _abrir_xlsx(conteudo):
+    # As etapas do load_workbook(read_only=True) menos a leitura das abas
+    leitor = ExcelReader(io.BytesIO(conteudo), read_only=True, data_only=True, keep_links=False)
+    leitor.read_manifest()
+    leitor.read_strings()
+    leitor.read_workbook()
+    apply_stylesheet(leitor.archive, leitor.wb)
+    return leitor
+
+
+def _converter_celula(celula):
+    # Mesma conversão do leitor openpyxl do pandas, para o resultado ser idêntico ao read_excel
+    if celula is None or celula['value'] is None:
+        return ''
+    if celula['data_type'] == TYPE_ERROR:
+        return np.nan
+    if celula['data_type'] == TYPE_NUMERIC:
+        val = int(celula['value'])
+        return val if val == celula['value'] else float(celula['value'])
+    return celula['value']
+
+
+def _linhas_xml(leitor, fonte):
+    # {coluna: célula} por linha a partir da 1, com as linhas ausentes do XML vazias (como o iter_rows)
+    wb = leitor.wb
+    parser = WorkSheetParser(fonte, leitor.shared_strings, data_only=True, epoch=wb.epoch,
+                             date_formats=wb._date_formats, timedelta_formats=wb._timedelta_formats)
+    proxima = 1
+    for idx, celulas in parser.parse():
+        if idx < proxima:
+            continue
+        for _ in range(proxima, idx):
+            yield {}
+        proxima = idx + 1
+        yield {c['column']: c for c in celulas}
+
+
+def _ultima_linha_com_dados(xml):
+    # Número da última <row> com algum valor no trecho, procurando de trás para frente
+    fim = xml.rfind(b'</row>')
+    while fim > 0:
+        inicio = xml.rfind(b'<row', 0, fim)
+        if inicio < 0:
+            break
+        if _RE_VALOR_CELULA.search(xml, inicio, fim):
+            numero = _RE_NUMERO_LINHA.match(xml, inicio)
+            return int(numero.group(1)) if numero else 0
+        fim = inicio
+    return 0
+
+
+class _XmlPodado:
+    # Arquivo só de leitura para o WorkSheetParser: lê o XML da aba em blocos que
+    # terminam num </row> e tira as células fora de `colunas` (números, base 1).
+    # Um bloco com <row>/<c> sem r="..." passa inteiro (a posição da célula
+    # dependeria das anteriores). Guarda a última linha com valor nos blocos podados,
+    # que pode estar só nas células removidas.
+
+    def __init__(self, fonte, colunas, bloco=None):
+        self._fonte = fonte
+        self._bloco = bloco or BLOCO_XML
+        letras = '|'.join(get_column_letter(c) for c in sorted(colunas)).encode()
+        self._fora = re.compile(rb'<c r="(?!(?:' + letras + rb')\d)[A-Z]+\d+"[^>]*?(?:/>|(?<!/)>.*?</c>)', re.DOTALL)
+        self._pendente = b''
+        self._saida = b''
+        self._posicao = 0
+        self._fim = False
+        self.ultima_linha = 0
+
+    def _podar(self, trecho):
+        if _RE_SEM_REFERENCIA.search(trecho):
+            return trecho
+        self.ultima_linha = max(self.ultima_linha, _ultima_linha_com_dados(trecho))
+        return self._fora.sub(b'', trecho)
+
+    def read(self, n=-1):
+        while not self._fim and (n < 0 or len(self._saida) - self._posicao < n):
+            lido = self._fonte.read(self._bloco)
+            buffer = self._pendente + lido
+            corte = len(buffer) if not lido else buffer.rfind(b'</row>') + 6
+            if not lido:
+                self._fim = True
+            elif corte < 6:
+                self._pendente = buffer
+                continue
+            self._saida = self._saida[self._posicao:] + self._podar(buffer[:corte])
+            self._posicao = 0
+            self._pendente = buffer[corte:]
+        fim = len(self._saida) if n < 0 else self._posicao + n
+        dados = self._saida[self._posicao:fim]
+        self._posicao = fim
+        return dados
+
+
+def _ler_tabela(linhas):
+    return TextParser(linhas, header=0, skip_blank_lines=False).read()
+
+
+def _ler_aba(leitor, parte):
+    with leitor.archive.open(parte) as fonte:
+        cabecalho = next(_linhas_xml(leitor, fonte), {})
+    cabecalho = [_converter_celula(cabecalho.get(i)) for i in range(1, max(cabecalho, default=0) + 1)]
+    while cabecalho and cabecalho[-1] == '':
+        cabecalho.pop()
+    if not cabecalho:
+        return pd.DataFrame()
+
+    # Resolve as colunas pelo cabeçalho (com os mesmos nomes "Unnamed: n"/"X.1" do pandas)
+    nomes = _ler_tabela([cabecalho]).columns
+    normalizados = nomes.astype(str).str.strip().str.upper()
+    usadas = {c for c in detectar_colunas(normalizados).values() if c}
+    colunas = [i + 1 for i, n in enumerate(normalizados) if n in usadas]
+    if not colunas:
+        return pd.DataFrame(columns=nomes)
+
+    dados = []
+    ultima_com_dados = -1
+    with leitor.archive.open(parte) as fonte:
+        podado = _XmlPodado(fonte, colunas)
+        linhas = _linhas_xml(leitor, podado)
+        next(linhas, None)
+        for row in linhas:
+            if any(c['value'] is not None for c in row.values()):
+                ultima_com_dados = len(dados)
+            dados.append([_converter_celula(row.get(i)) for i in colunas])
+    # Linhas com valor só nas colunas removidas também contam para o corte do fim (a 1ª é o cabeçalho)
+    ultima_com_dados = max(ultima_com_dados, podado.ultima_linha - 2)
+    dados = dados[:ultima_com_dados + 1]
+
+    return _ler_tabela([[str(nomes[i - 1]) for i in colunas]] + dados)
+
+
+def ler_csv(conteudo):
+    # CSV exportado no padrão brasileiro: tudo como texto (limpar_valor trata "1.500,50")
+    # e datas dia/mês; o separador é detectado
+    try:
+        texto = conteudo.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        texto = conteudo.decode('latin-1')
+    df = pd.read_csv(io.StringIO(texto), sep=None, engine='python', dtype=str, skip_blank_lines=False)
+    df = df.set_axis(df.columns.astype(str).str.strip().str.upper(), axis=1)
+    col_data = detectar_colunas(df.columns)['data']
+    if col_data:
+        df[col_data] = pd.to_datetime(df[col_data], dayfirst=True, errors='coerce')
+    return df
+
+
+def ler_abas(conteudo, nomes):
+    # Devolve (nome, df) das abas pedidas, cada uma apenas com as colunas detectadas
+    leitor = _abrir_xlsx(conteudo)
+    try:
+        partes = _partes_abas(leitor.archive)
+        for nome in nomes:
+            yield nome, _ler_aba(leitor, partes[nome])
+    finally:
+        leitor.archive.close()
+
+
+# ==============================================================================
+# INGESTÃO INCREMENTAL (FINGERPRINT POR ABA)
+# ==============================================================================
+_NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_NS_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+_RE_SHARED_STRING = re.compile(rb'(<(?:\w+:)?c\b[^>]*?\bt="s"[^>]*>\s*<(?:\w+:)?v>)(\d+)(</)')
+_RE_NUM_FMTS = re.compile(rb'<(?:\w+:)?numFmts\b.*?</(?:\w+:)?numFmts>', re.DOTALL)
+_RE_CELL_XFS = re.compile(rb'<(?:\w+:)?cellXfs\b.*?</(?:\w+:)?cellXfs>', re.DOTALL)
+_RE_NUM_FMT_ID = re.compile(rb'<(?:\w+:)?xf\b[^>]*?\bnumFmtId="(\d+)"')
+
+
+def _partes_abas(zf):
+    # Mapeia nome da aba -> caminho do XML dentro do zip, na ordem da pasta de trabalho
+    rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    alvos = {r.get('Id'): r.get('Target') for r in rels.iter(f'{_NS_PKG_REL}Relationship')}
+
+    partes = {}
+    workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+    for sheet in workbook.iter(f'{_NS_MAIN}sheet'):
+        alvo = alvos.get(sheet.get(f'{_NS_REL}id'), '')
+        partes[sheet.get('name')] = alvo.lstrip('/') if alvo.startswith('/') else f'xl/{alvo}'
+    return partes
+
+
+def _shared_strings(zf):
+    if 'xl/sharedStrings.xml' not in zf.namelist():
+        return []
+    raiz = ET.fromstring(zf.read('xl/sharedStrings.xml'))
+    return [''.join(t.text or '' for t in si.iter(f'{_NS_MAIN}t')) for si in raiz.iter(f'{_NS_MAIN}si')]
+
+
+def _digest_formatos(zf):
+    # Do styles.xml só interessam os formatos de número de cada estilo de célula
+    # (definem quais números são datas); fontes, cores e bordas ficam de fora.
+    if 'xl/styles.xml' not in zf.namelist():
+        return b''
+    estilos = zf.read('xl/styles.xml')
+    h = hashlib.sha1()
+    for bloco in _RE_NUM_FMTS.findall(estilos):
+        h.update(bloco)
+    for bloco in _RE_CELL_XFS.findall(estilos):
+        h.update(b'\x00' + b','.join(_RE_NUM_FMT_ID.findall(bloco)))
+    return h.digest()
+
+
+def fingerprints_abas(conteudo, nomes=None):
+    # O XML da aba referencia textos por índice no sharedStrings.xml, e esses
+    # índices mudam quando uma aba anterior ganha um texto novo. Por isso cada
+    # índice é trocado pelo próprio texto antes do hash: uma edição só invalida
+    # a aba editada.
+    with zipfile.ZipFile(io.BytesIO(conteudo)) as zf:
+        partes = _partes_abas(zf)
+        textos = [escape(t).encode('utf-8') for t in _shared_strings(zf)]
+        digest_formatos = _digest_formatos(zf)
+
+        def texto(m):
+            return m.group(1) + textos[int(m.group(2))] + m.group(3)
+
+        fingerprints = {}
+        for nome, parte in partes.items():
+            if nomes is not None and nome not in nomes:
+                continue
+            xml = _RE_SHARED_STRING.sub(texto, zf.read(parte))
+            fingerprints[nome] = hashlib.sha1(digest_formatos + xml).hexdigest()
+    return fingerprints
+
+
+def nomes_abas(conteudo):
+    with zipfile.ZipFile(io.BytesIO(conteudo)) as zf:
+        return list(_partes_abas(zf))
+
+
+# ==============================================================================
+# PROCESSAMENTO PARALELO DAS ABAS (OPCIONAL)
+# ==============================================================================
+# 1 = serial (padrão). Com mais workers, só paraleliza a partir de MIN_ABAS_PARALELO abas alteradas.
+ETL_WORKERS = int(os.environ.get('OHANA_ETL_WORKERS', '1'))
+MIN_ABAS_PARALELO = int(os.environ.get('OHANA_ETL_MIN_ABAS_PARALELO', '4'))
+
+_conteudo_worker = None
+
+
+def _iniciar_worker(conteudo):
+    global _conteudo_worker
+    _conteudo_worker = conteudo
+
+
+def _processar_aba_worker(nome):
+    logs_aba = []
+    for _, df in ler_abas(_conteudo_worker, [nome]):
+        return processar_aba(nome, df, logs_aba), logs_aba
+
+
+def processar_abas(conteudo, nomes, workers=1):
+    # Devolve [(df_temp, logs_aba), ...] na mesma ordem de `nomes`
+    if workers <= 1 or len(nomes) < MIN_ABAS_PARALELO:
+        resultados = []
+        leitor = ler_abas(conteudo, nomes)
+        try:
+            for nome in nomes:
+                with etapa('leitura xlsx', aba=nome) as reg:
+                    _, df = next(leitor)
+                    reg['linhas_lidas'] = len(df)
+                logs_aba = []
+                with etapa('limpeza', aba=nome) as reg:
+                    df_temp = processar_aba(nome, df, logs_aba)
+                    reg['linhas_validas'] = 0 if df_temp is None else len(df_temp)
+                resultados.append((df_temp, logs_aba))
+        finally:
+            leitor.close()
+        return resultados
+
+    # spawn: o processo do Streamlit tem threads, e fork com threads ativas não é seguro
+    with etapa('leitura + limpeza (paralelo)', abas=len(nomes), workers=workers) as reg:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(nomes)),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_iniciar_worker,
+            initargs=(conteudo,),
+        ) as pool:
+            resultados = list(pool.map(_processar_aba_worker, nomes))
+        reg['linhas_validas'] = sum(0 if df_temp is None else len(df_temp) for df_temp, _ in resultados)
+    return resultados
+
+
+class IngestaoIncremental:
+    # Guarda o df_temp limpo de cada aba entre execuções e só reprocessa as abas
+    # cujo fingerprint mudou. Conciliação (com memória própria) e backfill de
+    # PRODUTO são sempre refeitos no final.
+    #
+    # `conteudo` é o xlsx em bytes ou {nome_arquivo: bytes} (FonteLocal): cada
+    # .csv vale como uma aba com o nome do arquivo e fingerprint = hash do arquivo.
+
+    def __init__(self, workers=None):
+        self.workers = ETL_WORKERS if workers is None else workers
+        self._abas = {}  # (arquivo, aba) -> (fingerprint, df_temp ou None, logs da aba)
+        self._lock = threading.Lock()
+        self.versao = None
+        self.ultimas_alteradas = []
+        self.conciliador = Conciliador()
+
+    def carregar(self, conteudo):
+        with self._lock:
+            return self._carregar(conteudo)
+
+    @staticmethod
+    def _eh_csv(arquivo):
+        return arquivo is not None and arquivo.lower().endswith('.csv')
+
+    def _carregar(self, conteudo):
+        arquivos = conteudo if isinstance(conteudo, dict) else {None: conteudo}
+        relevantes = []
+        fingerprints = {}
+        with etapa('fingerprints') as reg:
+            for arquivo, dados in arquivos.items():
+                if self._eh_csv(arquivo):
+                    nome = os.path.splitext(arquivo)[0]
+                    fps = {nome: hashlib.sha1(dados).hexdigest()} if classificar_aba(nome) else {}
+                else:
+                    fps = fingerprints_abas(dados, {n for n in nomes_abas(dados) if classificar_aba(n)})
+                    fps = {n: fps[n] for n in nomes_abas(dados) if n in fps}
+                for nome, fp in fps.items():
+                    relevantes.append((arquivo, nome))
+                    fingerprints[(arquivo, nome)] = fp
+            reg['abas'] = len(relevantes)
+
+        alteradas = [c for c in relevantes if self._abas.get(c, (None,))[0] != fingerprints[c]]
+        for arquivo, dados in arquivos.items():
+            nomes = [n for a, n in alteradas if a == arquivo]
+            if not nomes:
+                continue
+            if self._eh_csv(arquivo):
+                resultados = [self._processar_csv(nomes[0], dados)]
+            else:
+                resultados = processar_abas(dados, nomes, self.workers)
+            for nome, (df_temp, logs_aba) in zip(nomes, resultados):
+                self._abas[(arquivo, nome)] = (fingerprints[(arquivo, nome)], df_temp, logs_aba)
+
+        self._abas = {c: self._abas[c] for c in relevantes}
+        self.ultimas_alteradas = [n for _, n in alteradas]
+        self.versao = hashlib.sha1('|'.join(
+            f'{n}:{fingerprints[(a, n)]}' if a is None else f'{a}/{n}:{fingerprints[(a, n)]}'
+            for a, n in relevantes
+        ).encode('utf-8')).hexdigest()
+
+        logs = []
+        df_list = []
+        for chave in relevantes:
+            _, df_temp, logs_aba = self._abas[chave]
+            logs.extend(logs_aba)
+            if df_temp is not None:
+                df_list.append(df_temp)
+
+        df_final = montar_dataset(df_list, self.conciliador)
+        return df_final, logs + self.conciliador.resumo()
+
+    @staticmethod
+    def _processar_csv(nome, dados):
+        with etapa('leitura csv', aba=nome) as reg:
+            df = ler_csv(dados)
+            reg['linhas_lidas'] = len(df)
+        logs_aba = []
+        with etapa('limpeza', aba=nome) as reg:
+            df_temp = processar_aba(nome, df, logs_aba)
+            reg['linhas_validas'] = 0 if df_temp is None else len(df_temp)
+        return df_temp, logs_aba
+
+
+# ==============================================================================
+# SNAPSHOT EM DISCO (PARTIDA A FRIO)
+# ==============================================================================
+# Incrementar sempre que COLUNAS_FINAIS ou os tipos gravados mudarem
+SNAPSHOT_VERSAO = 3
+CACHE_DIR = os.environ.get('OHANA_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+SNAPSHOT_PATH = os.path.join(CACHE_DIR, 'dataset.feather')
+
+
+def _schema_valido(schema):
+    if schema.names != COLUNAS_FINAIS:
+        return False
+    return pa.types.is_floating(schema.field('VALOR').type) and \
+        pa.types.is_timestamp(schema.field('DATA').type) and \
+        all(pa.types.is_dictionary(schema.field(c).type) for c in COLUNAS_CATEGORICAS)
+
+
+def salvar_snapshot(df, logs, caminho=None, versao=None):
+    if df.empty:
+        return False
+    caminho = caminho or SNAPSHOT_PATH
+    tabela = pa.Table.from_pandas(df[COLUNAS_FINAIS], preserve_index=False)
+    metadados = dict(tabela.schema.metadata or {})
+    metadados[b'ohana'] = json.dumps({
+        'snapshot_versao': SNAPSHOT_VERSAO,
+        'versao': versao,
+        'logs': logs,
+    }).encode('utf-8')
+    tabela = tabela.replace_schema_metadata(metadados)
+
+    # Grava em arquivo temporário e troca de uma vez para nunca expor um snapshot pela metade
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f'{caminho}.tmp'
+    feather.write_feather(tabela, temporario, compression='uncompressed')
+    os.replace(temporario, caminho)
+    return True
+
+
+def ler_snapshot(caminho=None):
+    # Devolve (df, logs, versao) ou None se o arquivo não existir ou for de outra versão/schema
+    caminho = caminho or SNAPSHOT_PATH
+    if not os.path.exists(caminho):
+        return None
+    try:
+        tabela = feather.read_table(caminho, memory_map=True)
+        meta = json.loads((tabela.schema.metadata or {}).get(b'ohana', b'{}'))
+        if meta.get('snapshot_versao') != SNAPSHOT_VERSAO or not _schema_valido(tabela.schema):
+            return None
+        return tabela.to_pandas(), meta.get('logs', []), meta.get('versao')
+    except (OSError, ValueError, pa.ArrowException):
+        return None
+
+
+# ==============================================================================
+# ATUALIZAÇÃO EM SEGUNDO PLANO (STALE-WHILE-REVALIDATE)
+# ==============================================================================
+class AtualizadorDados:
+    # Serve sempre o último dataset bom; quando ele passa do TTL, recarrega numa
+    # thread separada e troca a referência de uma vez só quando a carga dá certo.
+    # `carregar` devolve (df, logs, versao), None quando a fonte não mudou (o
+    # dataset atual continua valendo) e levanta exceção em caso de falha.
+
+    def __init__(self, carregar, ttl=600, inicial=None, atualizado_em=None):
+        self._carregar = carregar
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._thread = None
+        self.dados = inicial
+        # Semente sem horário (ex.: snapshot recém-lido) conta como carregada agora
+        if inicial is None:
+            self.atualizado_em = None
+        else:
+            self.atualizado_em = time.time() if atualizado_em is None else atualizado_em
+        self.ultima_tentativa = None
+        self.ultimo_erro = None
+
+    @property
+    def atualizando(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def idade(self):
+        return None if self.atualizado_em is None else time.time() - self.atualizado_em
+
+    def obter(self):
+        if self.dados is None:
+            # Sem nada para servir: a primeira carga bloqueia (falhas ficam em cache pelo TTL)
+            with self._lock:
+                if self.dados is None and not self._erro_recente():
+                    self._executar()
+            if self.dados is None:
+                return pd.DataFrame(), [f"Erro Crítico: {self.ultimo_erro}"], None
+        elif self.idade() >= self.ttl and not self._erro_recente():
+            self.atualizar()
+        return self.dados
+
+    def atualizar(self):
+        with self._lock:
+            if self.atualizando:
+                return False
+            self._thread = threading.Thread(target=self._executar, daemon=True)
+            self._thread.start()
+            return True
+
+    def _erro_recente(self):
+        return self.ultimo_erro is not None and self.ultima_tentativa is not None and \
+            time.time() - self.ultima_tentativa < self.ttl
+
+    def _executar(self):
+        self.ultima_tentativa = time.time()
+        try:
+            novos = self._carregar()
+        except Exception as e:
+            self.ultimo_erro = str(e)
+            return
+        if novos is not None:
+            self.dados = novos
+        self.atualizado_em = time.time()
+        self.ultimo_erro = None
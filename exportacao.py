@@ -0,0 +1,199 @@
+import codecs
+import os
+import re
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import analise
+
+# ==============================================================================
+# EXPORTAÇÃO EM LOTES (CSV, XLSX E PARQUET)
+# ==============================================================================
+# Os arquivos só são gerados quando alguém clica no download (o st.download_button
+# recebe uma função). As linhas são lidas, formatadas e gravadas em lotes de
+# TAMANHO_LOTE, e o arquivo vai para um SpooledTemporaryFile que passa para o
+# disco acima de LIMITE_MEMORIA_MB: a memória de trabalho depende do lote, não do
+# tamanho da seleção. Moeda no padrão do format_currency ("R$ 1.234,56") no CSV
+# e como formato de número "R$" no xlsx; no Parquet os valores ficam numéricos.
+TAMANHO_LOTE = int(os.environ.get('OHANA_EXPORTACAO_LOTE', '50000'))
+LIMITE_MEMORIA_MB = 8
+
+FORMATOS = {
+    'csv': ('CSV', 'text/csv', 'csv'),
+    'xlsx': ('Excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'parquet': ('Parquet', 'application/vnd.apache.parquet', 'parquet'),
+}
+COLUNAS_RESUMO = {'CURSO': 'Nº Controle', 'RECEITA': 'Receita', 'DESPESA': 'Despesa', 'RESULTADO': 'Resultado'}
+_TROCA_SEPARADORES = str.maketrans(',.', '.,')
+
+
+def formatar_brl(valores):
+    # Mesmo texto do format_currency do dashboard, aplicado a um lote
+    return [f"R$ {v:,.2f}".translate(_TROCA_SEPARADORES) for v in valores]
+
+
+# ==============================================================================
+# LOTES
+# ==============================================================================
+def lotes_detalhe(df, posicoes, tamanho=None):
+    """Linhas da tabela detalhada (posições já filtradas e ordenadas), um DataFrame por lote."""
+    tamanho = tamanho or TAMANHO_LOTE
+    colunas = list(analise.COLUNAS_DETALHE)
+    for inicio in range(0, max(len(posicoes), 1), tamanho):
+        yield df.iloc[posicoes[inicio:inicio + tamanho]][colunas].rename(columns=analise.COLUNAS_DETALHE)
+
+
+def resumo_por_controle(df_chart):
+    # Receita e despesa validada por Nº Controle (o df_chart dos gráficos) com o resultado
+    resumo = df_chart[['CURSO', 'RECEITA', 'DESPESA']].assign(RESULTADO=df_chart['RECEITA'] - df_chart['DESPESA'])
+    return resumo.sort_values('RECEITA', ascending=False, kind='stable').rename(columns=COLUNAS_RESUMO)
+
+
+def lotes_tabela(tabela, tamanho=None):
+    tamanho = tamanho or TAMANHO_LOTE
+    for inicio in range(0, max(len(tabela), 1), tamanho):
+        yield tabela.iloc[inicio:inicio + tamanho]
+
+
+def _tipos(lote, moeda):
+    # Colunas de moeda, de data e de texto (categorias viram texto simples)
+    datas = [c for c in lote.columns if pd.api.types.is_datetime64_any_dtype(lote[c])]
+    textos = [c for c in lote.columns if c not in moeda and c not in datas]
+    return datas, textos
+
+
+def _textos(serie):
+    return serie.astype(object).where(serie.notna(), None)
+
+
+# ==============================================================================
+# ESCRITORES
+# ==============================================================================
+def _escrever_csv(lotes, arquivo, moeda):
+    # ';' e BOM: abre direto no Excel em português
+    arquivo.write(codecs.BOM_UTF8)
+    for n, lote in enumerate(lotes):
+        datas, _ = _tipos(lote, moeda)
+        saida = lote.copy()
+        for c in moeda:
+            saida[c] = formatar_brl(lote[c].to_numpy(dtype='float64'))
+        for c in datas:
+            saida[c] = lote[c].dt.strftime('%d/%m/%Y')
+        arquivo.write(saida.to_csv(sep=';', index=False, header=n == 0).encode('utf-8'))
+
+
+# xlsx mínimo escrito direto no zip: uma aba, textos inline (sem sharedStrings)
+# e dois estilos, 1 = moeda "R$ #.##0,00" e 2 = data dd/mm/aaaa. O XML de cada
+# lote é montado coluna a coluna, sem um objeto por célula.
+_NS_XLSX = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_NS_RELS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_NS_DOC = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_TIPO_OOXML = 'application/vnd.openxmlformats-officedocument.spreadsheetml'
+_ESQUELETO_XLSX = {
+    '[Content_Types].xml': (
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        f'<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        f'<Override PartName="/xl/workbook.xml" ContentType="{_TIPO_OOXML}.sheet.main+xml"/>'
+        f'<Override PartName="/xl/worksheets/sheet1.xml" ContentType="{_TIPO_OOXML}.worksheet+xml"/>'
+        f'<Override PartName="/xl/styles.xml" ContentType="{_TIPO_OOXML}.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        f'<Relationships xmlns="{_NS_RELS}">'
+        f'<Relationship Id="rId1" Type="{_NS_DOC}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        f'<workbook xmlns="{_NS_XLSX}" xmlns:r="{_NS_DOC}">'
+        '<sheets><sheet name={aba} sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        f'<Relationships xmlns="{_NS_RELS}">'
+        f'<Relationship Id="rId1" Type="{_NS_DOC}/worksheet" Target="worksheets/sheet1.xml"/>'
+        f'<Relationship Id="rId2" Type="{_NS_DOC}/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/styles.xml': (
+        f'<styleSheet xmlns="{_NS_XLSX}">'
+        '<numFmts count="2"><numFmt numFmtId="164" formatCode="&quot;R$&quot; #,##0.00"/>'
+        '<numFmt numFmtId="165" formatCode="dd/mm/yyyy"/></numFmts>'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+_EPOCA_EXCEL = pd.Timestamp('1899-12-30')
+_RE_CONTROLE_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _celulas_texto(valores):
+    return ['<c/>' if v is None else f'<c t="inlineStr"><is><t xml:space="preserve">{escape(_RE_CONTROLE_XML.sub("", str(v)))}</t></is></c>'
+            for v in valores]
+
+
+def _celulas_numero(valores, estilo):
+    return ['<c/>' if v != v else f'<c s="{estilo}"><v>{v!r}</v></c>' for v in valores]
+
+
+def _escrever_xlsx(lotes, arquivo, moeda, nome_aba):
+    with zipfile.ZipFile(arquivo, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for nome, xml in _ESQUELETO_XLSX.items():
+            xml = xml.replace('{aba}', quoteattr(_RE_CONTROLE_XML.sub('', nome_aba)[:31]))
+            zf.writestr(nome, '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' + xml)
+        with zf.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as aba:
+            aba.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="{_NS_XLSX}"><sheetData>'.encode('utf-8'))
+            for n, lote in enumerate(lotes):
+                datas, _ = _tipos(lote, moeda)
+                if n == 0:
+                    aba.write(('<row>' + ''.join(_celulas_texto(lote.columns)) + '</row>').encode('utf-8'))
+                colunas = [
+                    _celulas_numero(lote[c].to_numpy(dtype='float64').tolist(), 1) if c in moeda
+                    else _celulas_numero(((lote[c] - _EPOCA_EXCEL) / pd.Timedelta(days=1)).tolist(), 2) if c in datas
+                    else _celulas_texto(_textos(lote[c]).tolist())
+                    for c in lote.columns
+                ]
+                aba.write(''.join('<row>' + ''.join(linha) + '</row>' for linha in zip(*colunas)).encode('utf-8'))
+            aba.write(b'</sheetData></worksheet>')
+
+
+def _escrever_parquet(lotes, arquivo, moeda):
+    escritor = None
+    try:
+        for lote in lotes:
+            _, textos = _tipos(lote, moeda)
+            lote = lote.assign(**{c: _textos(lote[c]) for c in textos})
+            if escritor is None:
+                schema = pa.Schema.from_pandas(lote, preserve_index=False)
+                schema = pa.schema([pa.field(f.name, pa.string()) if f.name in textos else f for f in schema])
+                escritor = pq.ParquetWriter(arquivo, schema.remove_metadata())
+            escritor.write_table(pa.Table.from_pandas(lote, schema=escritor.schema, preserve_index=False))
+    finally:
+        if escritor is not None:
+            escritor.close()
+
+
+def exportar(lotes, formato, moeda=(), nome_aba='Dados'):
+    """Grava os lotes no formato pedido e devolve o arquivo (posicionado no início)."""
+    arquivo = tempfile.SpooledTemporaryFile(max_size=LIMITE_MEMORIA_MB * 2**20)
+    if formato == 'csv':
+        _escrever_csv(lotes, arquivo, moeda)
+    elif formato == 'xlsx':
+        _escrever_xlsx(lotes, arquivo, moeda, nome_aba)
+    elif formato == 'parquet':
+        _escrever_parquet(lotes, arquivo, moeda)
+    else:
+        raise ValueError(f"Formato de exportação desconhecido: {formato}")
+    arquivo.seek(0)
+    return arquivo
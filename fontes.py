@@ -0,0 +1,143 @@
+import collections
+import hashlib
+import os
+import time
+import urllib.error
+import urllib.request
+
+import etl
+
+# ==============================================================================
+# FONTES DE DADOS (EXPORT HTTP OU DIRETÓRIO LOCAL)
+# ==============================================================================
+# Toda fonte tem buscar() -> (conteudo, info) e confirmar(). conteudo é None
+# quando nada mudou desde a última carga confirmada; aí nem o zip é aberto.
+# confirmar() só é chamado depois que a carga deu certo, para uma falha no
+# meio do caminho não fazer a próxima busca achar que "nada mudou".
+#
+# OHANA_FONTE_DIR=/caminho -> FonteLocal (xlsx e CSV do diretório, ou um arquivo)
+# OHANA_FONTE_URL=https://... -> FonteHTTP com outra URL (padrão: export da planilha)
+EXTENSOES_LOCAIS = ('.xlsx', '.csv')
+
+
+def _hash(dados):
+    return hashlib.sha1(dados).hexdigest()
+
+
+class Fonte:
+    def __init__(self, descricao):
+        self.descricao = descricao
+        self.historico = collections.deque(maxlen=20)  # info de cada busca, a mais recente por último
+        self._pendente = None
+
+    def buscar(self):
+        inicio = time.perf_counter()
+        conteudo, status, tamanho = self._buscar()
+        info = {
+            'quando': time.strftime('%d/%m %H:%M:%S'),
+            'fonte': self.descricao,
+            'status': status,
+            'bytes': tamanho,
+            'segundos': round(time.perf_counter() - inicio, 3),
+        }
+        self.historico.append(info)
+        return conteudo, info
+
+    def hash_conteudo(self):
+        # Hash do conteúdo da última busca, mesmo antes de confirmar()
+        return self._pendente[-1] if self._pendente is not None else self.hash
+
+    def confirmar(self):
+        if self._pendente is not None:
+            self._aplicar(self._pendente)
+            self._pendente = None
+
+
+class FonteHTTP(Fonte):
+    # Requisição condicional com If-None-Match / If-Modified-Since; se o servidor
+    # não manda ETag nem Last-Modified (caso do export do Google), compara o
+    # hash do corpo com o da última carga confirmada.
+
+    def __init__(self, url=etl.URL_PLANILHA, timeout=120):
+        super().__init__(url.split('?')[0])
+        self.url = url
+        self.timeout = timeout
+        self.etag = None
+        self.last_modified = None
+        self.hash = None
+
+    def _buscar(self):
+        pedido = urllib.request.Request(self.url)
+        if self.etag:
+            pedido.add_header('If-None-Match', self.etag)
+        if self.last_modified:
+            pedido.add_header('If-Modified-Since', self.last_modified)
+        try:
+            with urllib.request.urlopen(pedido, timeout=self.timeout) as resp:
+                corpo = resp.read()
+                cabecalhos = resp.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return None, 'sem mudança (304)', 0
+            raise
+
+        hash_corpo = _hash(corpo)
+        estado = (cabecalhos.get('ETag'), cabecalhos.get('Last-Modified'), hash_corpo)
+        if hash_corpo == self.hash:
+            # Mesmo corpo da carga confirmada: já pode guardar os cabeçalhos novos
+            self._aplicar(estado)
+            return None, 'sem mudança (hash)', len(corpo)
+        self._pendente = estado
+        return corpo, 'novo', len(corpo)
+
+    def _aplicar(self, pendente):
+        self.etag, self.last_modified, self.hash = pendente
+
+
+class FonteLocal(Fonte):
+    # Lê os .xlsx/.csv de um diretório (ou um único arquivo). Se nome, tamanho e
+    # mtime de todos os arquivos são os mesmos, nem abre os arquivos; se só o
+    # mtime mudou (arquivo regravado igual), o hash do conteúdo decide.
+
+    def __init__(self, caminho):
+        super().__init__(os.path.abspath(caminho))
+        self.caminho = caminho
+        self.assinatura = None
+        self.hash = None
+
+    def _arquivos(self):
+        if os.path.isfile(self.caminho):
+            return [self.caminho]
+        return sorted(
+            os.path.join(self.caminho, nome) for nome in os.listdir(self.caminho)
+            if nome.lower().endswith(EXTENSOES_LOCAIS) and not nome.startswith(('.', '~$'))
+        )
+
+    def _buscar(self):
+        arquivos = self._arquivos()
+        if not arquivos:
+            raise FileNotFoundError(f"Nenhum arquivo .xlsx/.csv em {self.caminho}")
+        assinatura = tuple((a, os.stat(a).st_size, os.stat(a).st_mtime_ns) for a in arquivos)
+        if assinatura == self.assinatura:
+            return None, 'sem mudança (arquivos)', 0
+
+        conteudo = {}
+        for arquivo in arquivos:
+            with open(arquivo, 'rb') as f:
+                conteudo[os.path.basename(arquivo)] = f.read()
+        hash_total = _hash(b''.join(_hash(n.encode('utf-8') + d).encode() for n, d in conteudo.items()))
+        tamanho = sum(len(d) for d in conteudo.values())
+        if hash_total == self.hash:
+            self._aplicar((assinatura, hash_total))
+            return None, 'sem mudança (hash)', tamanho
+        self._pendente = (assinatura, hash_total)
+        return conteudo, 'novo', tamanho
+
+    def _aplicar(self, pendente):
+        self.assinatura, self.hash = pendente
+
+
+def criar_fonte():
+    if os.environ.get('OHANA_FONTE_DIR'):
+        return FonteLocal(os.environ['OHANA_FONTE_DIR'])
+    return FonteHTTP(os.environ.get('OHANA_FONTE_URL', etl.URL_PLANILHA))
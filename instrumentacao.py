@@ -0,0 +1,88 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+# ==============================================================================
+# INSTRUMENTAÇÃO (ETAPAS NOMEADAS COM TEMPO, LINHAS E MEMÓRIA)
+# ==============================================================================
+# OHANA_INSTRUMENTACAO=0 desliga tudo; OHANA_LOG_JSON=1 imprime uma linha JSON por etapa no stderr
+ATIVO = os.environ.get('OHANA_INSTRUMENTACAO', '1') != '0'
+
+logger = logging.getLogger('ohana.instrumentacao')
+if os.environ.get('OHANA_LOG_JSON') == '1' and not logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+_rastreio_atual = contextvars.ContextVar('rastreio_atual', default=None)
+_ultimos = {}
+_ultimos_lock = threading.Lock()
+
+
+def memoria_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        # Fora do Linux só há o pico (em KB no Linux/BSD, bytes no macOS)
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return pico / 2**20 if sys.platform == 'darwin' else pico / 2**10
+
+
+class Rastreio:
+    def __init__(self, nome):
+        self.nome = nome
+        self.etapas = []
+        self.inicio = time.time()
+
+    @contextlib.contextmanager
+    def etapa(self, nome, **info):
+        registro = {'rastreio': self.nome, 'etapa': nome, **info}
+        mem_inicio = memoria_rss_mb()
+        t0 = time.perf_counter()
+        try:
+            yield registro
+        finally:
+            registro['segundos'] = round(time.perf_counter() - t0, 6)
+            registro['memoria_delta_mb'] = round(memoria_rss_mb() - mem_inicio, 2)
+            self.etapas.append(registro)
+            logger.info(json.dumps(registro, ensure_ascii=False, default=str))
+
+    def total(self):
+        return sum(e['segundos'] for e in self.etapas)
+
+
+@contextlib.contextmanager
+def rastrear(nome):
+    # Abre um rastreio raiz; as chamadas a etapa() feitas dentro dele (na mesma thread) são registradas
+    if not ATIVO:
+        yield None
+        return
+    rastreio = Rastreio(nome)
+    token = _rastreio_atual.set(rastreio)
+    try:
+        yield rastreio
+    finally:
+        _rastreio_atual.reset(token)
+        with _ultimos_lock:
+            _ultimos[nome] = rastreio
+
+
+def etapa(nome, **info):
+    # Sem rastreio ativo (ou desligado) é um nullcontext: custo desprezível
+    rastreio = _rastreio_atual.get()
+    if rastreio is None:
+        return contextlib.nullcontext({})
+    return rastreio.etapa(nome, **info)
+
+
+def ultimo(nome):
+    with _ultimos_lock:
+        return _ultimos.get(nome)
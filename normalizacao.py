@@ -0,0 +1,110 @@
+import math
+import numbers
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# MOTOR DE NORMALIZAÇÃO (ESCALAR OU SÉRIE, UMA VEZ POR VALOR DISTINTO)
+# ==============================================================================
+# Nas séries, cada função fatoriza os valores, trata cada texto distinto uma
+# única vez e devolve o resultado mapeado para todas as linhas. As colunas de
+# controle e entidade se repetem milhares de vezes, então o custo passa a
+# acompanhar a quantidade de valores distintos e não a de linhas.
+_RE_NAO_ALFANUMERICO = re.compile(r'[^a-z0-9]+')
+_RE_ID_INICIAL = re.compile(r'\s*(\d+)(?=\s|$)')
+_RE_SUFIXO_NUMERICO = re.compile(r'(?:\s+[\d.,/\-]+)+\s*$')
+_RE_DECIMAL_ZERO = re.compile(r'\.0$')
+
+
+def _vazio(valor):
+    return valor is None or (isinstance(valor, float) and math.isnan(valor)) or valor is pd.NA or valor is pd.NaT
+
+
+def aplicar_por_valor_unico(serie, func, dtype=object):
+    codigos, unicos = pd.factorize(serie)
+    # O índice -1 (valores nulos) cai no último elemento, que é func(None)
+    resultados = np.array([func(v) for v in unicos] + [func(None)], dtype=dtype)
+    return pd.Series(resultados[codigos], index=serie.index, name=serie.name)
+
+
+def _normalizar_texto(texto):
+    if _vazio(texto):
+        return ''
+    sem_acento = ''.join(c for c in unicodedata.normalize('NFD', str(texto)) if not unicodedata.combining(c))
+    return _RE_NAO_ALFANUMERICO.sub(' ', sem_acento.lower()).strip()
+
+
+def _extrair_id(texto):
+    if _vazio(texto):
+        return None
+    match = _RE_ID_INICIAL.match(str(texto))
+    return match.group(1) if match else None
+
+
+def _gerar_sugestao(texto):
+    if _vazio(texto):
+        return ''
+    return _RE_SUFIXO_NUMERICO.sub('', str(texto)).strip()
+
+
+def _limpar_valor(valor):
+    if _vazio(valor) or isinstance(valor, bool):
+        return 0.0
+    if isinstance(valor, numbers.Number):
+        return float(valor)
+    texto = str(valor).replace('R$', '').replace('.', '').replace(',', '.').strip()
+    try:
+        numero = float(texto)
+    except ValueError:
+        return 0.0
+    return 0.0 if math.isnan(numero) else numero
+
+
+def _texto_controle(valor):
+    # Mesmo tratamento do .fillna('').astype(str).str.strip().str.upper() (+ remoção do ".0")
+    return '' if _vazio(valor) else _RE_DECIMAL_ZERO.sub('', str(valor).strip().upper())
+
+
+def _texto_maiusculo(valor):
+    return '' if _vazio(valor) else str(valor).strip().upper()
+
+
+def normalizar_texto(texto):
+    """Minúsculas, sem acentos e com qualquer pontuação virando um único espaço."""
+    if isinstance(texto, pd.Series):
+        return aplicar_por_valor_unico(texto, _normalizar_texto)
+    return _normalizar_texto(texto)
+
+
+def extrair_id(texto):
+    """ID numérico no início do Nº Controle ("25016 PSICOLOGIA" -> "25016"), ou None."""
+    if isinstance(texto, pd.Series):
+        return aplicar_por_valor_unico(texto, _extrair_id)
+    return _extrair_id(texto)
+
+
+def gerar_sugestao(texto):
+    """Remove sufixos numéricos à direita ("25016 PSICOLOGIA 2" -> "25016 PSICOLOGIA")."""
+    if isinstance(texto, pd.Series):
+        return aplicar_por_valor_unico(texto, _gerar_sugestao)
+    return _gerar_sugestao(texto)
+
+
+def limpar_valor(valor):
+    """Converte moeda em texto ("R$ 1.500,50") para float; inválidos viram 0.0."""
+    if isinstance(valor, pd.Series):
+        if pd.api.types.is_numeric_dtype(valor):
+            return valor.fillna(0)
+        return aplicar_por_valor_unico(valor, _limpar_valor, dtype='float64')
+    return _limpar_valor(valor)
+
+
+def normalizar_controle(serie):
+    return aplicar_por_valor_unico(serie, _texto_controle)
+
+
+def normalizar_maiusculo(serie):
+    return aplicar_por_valor_unico(serie, _texto_maiusculo)
@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import etl
+import fontes
+import instrumentacao
+
+# ==============================================================================
+# PUBLICAÇÃO DO DATASET (ETL FORA DO STREAMLIT)
+# ==============================================================================
+# Uso: python publicacao.py --destino /srv/ohana/dados            (uma vez, p/ cron)
+#      python publicacao.py --destino /srv/ohana/dados --intervalo 600
+#
+# Este módulo não importa Streamlit nem Plotly. Cada versão publicada é uma
+# pasta <destino>/<versao>/ com dataset.feather (mesmo formato do snapshot),
+# cubo.feather, conciliacao.feather e manifesto.json; o arquivo <destino>/ATUAL
+# aponta para a versão mais nova e é trocado de forma atômica só depois que a
+# pasta está completa. Com OHANA_PUBLICACAO_DIR definido, o dashboard deixa de
+# rodar o ETL e só acompanha esse diretório.
+DIRETORIO = os.environ.get('OHANA_PUBLICACAO_DIR')
+INTERVALO_VERIFICACAO = float(os.environ.get('OHANA_PUBLICACAO_TTL', '30'))
+VERSOES_MANTIDAS = 3
+PONTEIRO = 'ATUAL'
+
+
+def versao_publicada(diretorio):
+    # Lê só o ponteiro (alguns bytes): barato o bastante para checar a cada rerun
+    try:
+        with open(os.path.join(diretorio, PONTEIRO), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def manifesto(diretorio, versao=None):
+    versao = versao or versao_publicada(diretorio)
+    if versao is None:
+        return None
+    try:
+        with open(os.path.join(diretorio, versao, 'manifesto.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _gravar_atomico(caminho, texto):
+    temporario = f'{caminho}.tmp'
+    with open(temporario, 'w', encoding='utf-8') as f:
+        f.write(texto)
+    os.replace(temporario, caminho)
+
+
+def publicar(df, logs, versao, diretorio, relatorio=None, hash_fonte=None, manter=VERSOES_MANTIDAS):
+    """Grava a versão e move o ponteiro; devolve False se ela já é a publicada ou o df está vazio."""
+    if df.empty or versao == versao_publicada(diretorio):
+        return False
+    os.makedirs(diretorio, exist_ok=True)
+    pasta = os.path.join(diretorio, versao)
+    temporaria = os.path.join(diretorio, f'.{versao}.{os.getpid()}.tmp')
+    shutil.rmtree(temporaria, ignore_errors=True)
+    os.makedirs(temporaria)
+
+    etl.salvar_snapshot(df, logs, caminho=os.path.join(temporaria, 'dataset.feather'), versao=versao)
+    with instrumentacao.etapa('cubo'):
+        cubo = etl.montar_cubo(df)
+    feather.write_feather(cubo, os.path.join(temporaria, 'cubo.feather'), compression='uncompressed')
+    if relatorio is not None and not relatorio.empty:
+        feather.write_feather(relatorio.astype({'Similaridade': 'float64'}), os.path.join(temporaria, 'conciliacao.feather'))
+    _gravar_atomico(os.path.join(temporaria, 'manifesto.json'), json.dumps({
+        'versao': versao,
+        'publicado_em': time.time(),
+        'linhas': len(df),
+        'hash_fonte': hash_fonte,
+        'snapshot_versao': etl.SNAPSHOT_VERSAO,
+    }, ensure_ascii=False))
+
+    shutil.rmtree(pasta, ignore_errors=True)
+    os.replace(temporaria, pasta)
+    _gravar_atomico(os.path.join(diretorio, PONTEIRO), versao)
+    _limpar_antigas(diretorio, versao, manter)
+    return True
+
+
+def _limpar_antigas(diretorio, atual, manter):
+    # Mantém as `manter` versões mais novas: quem ainda está lendo uma anterior tem margem
+    pastas = [
+        nome for nome in os.listdir(diretorio)
+        if nome != atual and os.path.isfile(os.path.join(diretorio, nome, 'manifesto.json'))
+    ]
+    pastas.sort(key=lambda nome: os.path.getmtime(os.path.join(diretorio, nome, 'manifesto.json')), reverse=True)
+    for nome in pastas[max(0, manter - 1):]:
+        shutil.rmtree(os.path.join(diretorio, nome), ignore_errors=True)
+
+
+def ler_publicacao(diretorio, versao=None):
+    # (df, logs, versao) da versão pedida (padrão: a atual) ou None se não houver/for incompatível
+    versao = versao or versao_publicada(diretorio)
+    if versao is None:
+        return None
+    return etl.ler_snapshot(os.path.join(diretorio, versao, 'dataset.feather'))
+
+
+def ler_agregado(diretorio, versao, nome):
+    # cubo / conciliacao de uma versão publicada; None se a pasta já foi limpa
+    caminho = os.path.join(diretorio, versao, f'{nome}.feather')
+    try:
+        return feather.read_table(caminho).to_pandas()
+    except (OSError, pa.ArrowException):
+        return None
+
+
+class LeitorPublicacao:
+    # Lado do dashboard: carregar() devolve None enquanto o ponteiro não muda, no
+    # mesmo contrato do AtualizadorDados para "a fonte não mudou".
+
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+        self.versao = None
+        self.relatorio = pd.DataFrame()
+
+    def carregar(self):
+        with instrumentacao.etapa('publicação', diretorio=self.diretorio) as reg:
+            atual = versao_publicada(self.diretorio)
+            reg['versao'] = atual
+            if atual is None:
+                raise FileNotFoundError(f"Nenhum dataset publicado em {self.diretorio}")
+            if atual == self.versao:
+                return None
+            dados = ler_publicacao(self.diretorio, atual)
+            if dados is None:
+                raise ValueError(f"Versão publicada {atual} ilegível ou de formato antigo")
+        relatorio = ler_agregado(self.diretorio, atual, 'conciliacao')
+        self.relatorio = pd.DataFrame() if relatorio is None else relatorio
+        self.versao = atual
+        return dados
+
+
+# ==============================================================================
+# WORKER (LINHA DE COMANDO)
+# ==============================================================================
+def executar(fonte, ingestao, destino, manter=VERSOES_MANTIDAS):
+    """Uma rodada: busca, processa só o que mudou e publica. Devolve a linha de resumo."""
+    inicio = time.perf_counter()
+    with instrumentacao.rastrear('publicação'):
+        with instrumentacao.etapa('download', fonte=fonte.descricao) as reg:
+            conteudo, info = fonte.buscar()
+            reg['bytes'] = info['bytes']
+            reg['status'] = info['status']
+        if conteudo is None:
+            return f"{info['status']}: nada a publicar ({info['segundos']:.1f} s)"
+        df, logs = ingestao.carregar(conteudo)
+        with instrumentacao.etapa('gravação'):
+            publicado = publicar(df, logs, ingestao.versao, destino, ingestao.conciliador.relatorio,
+                                 hash_fonte=fonte.hash_conteudo(), manter=manter)
+    fonte.confirmar()
+    segundos = time.perf_counter() - inicio
+    if not publicado:
+        return f"versão {ingestao.versao[:12]} já publicada ou sem linhas ({segundos:.1f} s)"
+    return f"publicada versão {ingestao.versao[:12]}: {len(df)} linhas em {segundos:.1f} s"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ETL sem Streamlit: processa a fonte e publica o dataset versionado.')
+    parser.add_argument('--destino', default=DIRETORIO, required=DIRETORIO is None,
+                        help='diretório compartilhado com o dashboard (padrão: OHANA_PUBLICACAO_DIR)')
+    parser.add_argument('--intervalo', type=float, default=0, help='segundos entre rodadas; 0 = roda uma vez')
+    parser.add_argument('--manter', type=int, default=VERSOES_MANTIDAS, help='versões mantidas no diretório')
+    args = parser.parse_args(argv)
+
+    fonte = fontes.criar_fonte()
+    # O hash da última publicação evita reprocessar a mesma planilha entre execuções do cron
+    anterior = manifesto(args.destino) or {}
+    fonte.hash = anterior.get('hash_fonte')
+    ingestao = etl.IngestaoIncremental()
+    while True:
+        try:
+            print(time.strftime('%d/%m %H:%M:%S'), executar(fonte, ingestao, args.destino, args.manter), flush=True)
+        except Exception as e:
+            if not args.intervalo:
+                raise
+            print(time.strftime('%d/%m %H:%M:%S'), f"falha: {e}", flush=True)
+        if not args.intervalo:
+            return
+        time.sleep(args.intervalo)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import pandas as pd
+import pytest
+
+import analise
+import etl
+
+
+@pytest.fixture
+def df():
+    linhas = [
+        ('25016 PSICOLOGIA', '25016 PSICOLOGIA', 'PÓS', 'ANA', 1000.0, '2024-01-05', 'RECEITA'),
+        ('25016 PSICOLOGIA', '25016 PSICOLOGIA', 'PÓS', 'BIA', 500.0, '2024-02-10', 'RECEITA'),
+        ('25017 DIREITO', '25017 DIREITO', 'MBA', 'CAIO', 300.0, None, 'RECEITA'),
+        ('25016 PSICOLOGIA', '25016 PSICOLOGIA', '', 'GRÁFICA', 200.0, '2024-01-20', 'DESPESA'),
+        ('25017 DIREITO', '25017 DIREITO', '', 'HOTEL', 50.0, '2024-02-01', 'DESPESA'),
+        ('99999 SEM RECEITA', '99999 SEM RECEITA', '', 'TÁXI', 80.0, '2024-02-03', 'DESPESA'),
+    ]
+    df = pd.DataFrame(linhas, columns=etl.COLUNAS_FINAIS)
+    df['DATA'] = pd.to_datetime(df['DATA'])
+    return etl.montar_dataset([df])
+
+
+def kpis_linha_a_linha(df_total, df_final):
+    """Cálculo original do Dashboard, direto nas linhas."""
+    cursos_validos_receita = df_total[df_total['TIPO'] == 'RECEITA']['CURSO'].unique()
+    receita = df_final[df_final['TIPO'] == 'RECEITA']['VALOR'].sum()
+    despesa = df_final[(df_final['TIPO'] == 'DESPESA') & (df_final['CURSO'].isin(cursos_validos_receita))]['VALOR'].sum()
+    return receita, despesa
+
+
+# --- CUBO DE AGREGADOS ---
+@pytest.mark.parametrize('produtos,controles', [
+    (None, None),
+    (['PÓS'], None),
+    (None, ['25017 DIREITO', '99999 SEM RECEITA']),
+    ([], None),
+])
+def test_kpis_do_cubo_iguais_aos_das_linhas(df, produtos, controles):
+    """Receita e despesa validada do cubo batem com o cálculo sobre as linhas brutas."""
+    cubo = analise.filtrar_cubo(etl.montar_cubo(df), produtos, controles)
+    kpis = analise.calcular_kpis(cubo)
+
+    receita, despesa = kpis_linha_a_linha(df, analise.filtrar_linhas(df, produtos, controles))
+    assert kpis['receita'] == pytest.approx(receita)
+    assert kpis['despesa'] == pytest.approx(despesa)
+    assert kpis['margem_contribuicao'] == pytest.approx(
+        receita - despesa - receita * analise.TAXA_BANCARIA - receita * analise.ALIQUOTA_DAS
+    )
+
+
+def test_cubo_mantem_controles_e_mes_sem_data(df):
+    """Despesas sem receita continuam listadas (não validadas) e NaT vira um mês próprio."""
+    cubo = etl.montar_cubo(df)
+
+    assert etl.valores_presentes(cubo['CURSO']) == etl.valores_presentes(df['CURSO'])
+    assert not cubo.loc[cubo['CURSO'] == '99999 SEM RECEITA', 'VALIDO'].any()
+    assert cubo['MES'].isna().sum() == 1
+    assert cubo['LINHAS'].sum() == len(df)
+
+
+def test_df_chart_por_controle(df):
+    """O gráfico soma receita e despesa validada por Nº Controle."""
+    df_chart = analise.montar_df_chart(etl.montar_cubo(df))
+
+    assert df_chart['CURSO'].tolist() == ['25016 PSICOLOGIA', '25017 DIREITO']
+    assert df_chart['RECEITA'].tolist() == [1500.0, 300.0]
+    assert df_chart['DESPESA'].tolist() == [200.0, 50.0]
+
+
+# --- TABELA DETALHADA ---
+def test_pagina_detalhe_respeita_ordem_e_filtro(df):
+    """As páginas reproduzem o sort_values original sobre as linhas filtradas."""
+    ordem = analise.ordem_detalhe(df, 'Data (mais recentes)')
+    mask = analise.mascara_linhas(df, controles=['25016 PSICOLOGIA', '99999 SEM RECEITA'])
+    esperado = (
+        df[mask].sort_values(['DATA', 'TIPO'], ascending=[False, True])
+        .rename(columns=analise.COLUNAS_DETALHE)[list(analise.COLUNAS_DETALHE.values())]
+    )
+
+    pagina1, total = analise.pagina_detalhe(df, ordem, mask, pagina=1, tamanho=2)
+    pagina2, _ = analise.pagina_detalhe(df, ordem, mask, pagina=2, tamanho=2)
+
+    assert total == 4
+    pd.testing.assert_frame_equal(pd.concat([pagina1, pagina2]), esperado)
+
+
+# --- PERÍODO (SOMAS MENSAIS ACUMULADAS) ---
+def linhas_no_periodo(df, inicio, fim, sem_data):
+    mask = df['DATA'].between(pd.Timestamp(inicio or '1900-01-01'), pd.Timestamp(fim or '2100-01-01') + pd.offsets.MonthEnd(0))
+    return df[mask | (df['DATA'].isna() & sem_data)]
+
+
+@pytest.mark.parametrize('inicio,fim,sem_data', [
+    (None, None, True),
+    ('2024-02-01', '2024-02-01', False),
+    ('2024-01-01', '2024-02-01', True),
+    ('2023-01-01', '2023-12-01', False),
+])
+def test_kpis_do_periodo_iguais_aos_das_linhas(df, inicio, fim, sem_data):
+    """O cubo do período (diferença das acumuladas) bate com o filtro por data nas linhas."""
+    serie = etl.SerieMensal(etl.montar_cubo(df))
+    kpis = analise.calcular_kpis(analise.cubo_periodo(serie, inicio, fim, sem_data))
+
+    receita, despesa = kpis_linha_a_linha(df, linhas_no_periodo(df, inicio, fim, sem_data))
+    assert kpis['receita'] == pytest.approx(receita)
+    assert kpis['despesa'] == pytest.approx(despesa)
+    assert etl.IndiceDatas(df).mascara(inicio, fim, sem_data).sum() == len(linhas_no_periodo(df, inicio, fim, sem_data))
+
+
+def test_tendencia_mensal_com_grupo_sem_data(df):
+    """Um ponto por mês do intervalo, só com despesa validada, e NaT como último grupo."""
+    tendencia = analise.tendencia_mensal(etl.SerieMensal(etl.montar_cubo(df)))
+
+    assert tendencia['MES'].iloc[:2].tolist() == [pd.Timestamp('2024-01-01'), pd.Timestamp('2024-02-01')]
+    assert pd.isna(tendencia['MES'].iloc[-1])
+    assert tendencia['RECEITA'].tolist() == [1000.0, 500.0, 300.0]
+    assert tendencia['DESPESA'].tolist() == [200.0, 50.0, 0.0]
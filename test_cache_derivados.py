@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+
+from cache_derivados import CacheDerivados, chave_selecao
+
+
+def test_acerto_falta_e_chave_da_selecao():
+    """A mesma seleção (em qualquer ordem) calcula uma vez só; None é diferente de lista vazia."""
+    cache = CacheDerivados(limite_mb=1)
+    cache.definir_versao('v1')
+    chamadas = []
+
+    def calcular():
+        chamadas.append(1)
+        return pd.DataFrame({'VALOR': [1.0, 2.0]})
+
+    primeiro = cache.obter('v1', ('kpis', chave_selecao(['B', 'A'])), calcular)
+    segundo = cache.obter('v1', ('kpis', chave_selecao(['A', 'B', 'A'])), calcular)
+    cache.obter('v1', ('kpis', chave_selecao(None)), calcular)
+    cache.obter('v1', ('kpis', chave_selecao([])), calcular)
+
+    assert segundo is primeiro
+    assert len(chamadas) == 3
+    assert cache.estatisticas()['acertos'] == 1
+    assert cache.estatisticas()['faltas'] == 3
+
+
+def test_lru_respeita_teto_de_memoria():
+    """Passando do teto, sai a entrada usada há mais tempo; valores maiores que o teto não entram."""
+    cache = CacheDerivados(limite_mb=0.25)
+    cache.definir_versao('v1')
+    bloco = lambda: np.zeros(100_000 // 8)  # ~100 KB
+
+    cache.obter('v1', 'a', bloco)
+    cache.obter('v1', 'b', bloco)
+    cache.obter('v1', 'a', bloco)  # 'a' passa a ser o mais recente
+    cache.obter('v1', 'c', bloco)  # despeja 'b'
+    cache.obter('v1', 'grande', lambda: np.zeros(2**20))
+
+    assert list(cache._itens) == ['a', 'c']
+    assert cache.estatisticas()['despejos'] == 1
+    assert cache.bytes <= cache.limite_bytes
+
+
+def test_versao_nova_invalida_tudo_e_versao_antiga_nao_entra():
+    """Trocar a versão esvazia o cache; um rerun atrasado com a versão anterior não o repovoa."""
+    cache = CacheDerivados(limite_mb=1)
+    cache.definir_versao('v1')
+    cache.obter('v1', 'kpis', lambda: 1)
+
+    cache.definir_versao('v2')
+    assert cache.obter('v2', 'kpis', lambda: 2) == 2
+    assert cache.obter('v1', 'kpis', lambda: 1) == 1
+    assert cache.obter('v2', 'kpis', lambda: 3) == 2
+
+    assert list(cache._itens) == ['kpis']
+    assert cache.estatisticas()['invalidacoes'] == 2
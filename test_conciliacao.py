@@ -0,0 +1,76 @@
+import random
+
+import pandas as pd
+import pytest
+
+import etl
+from conciliacao import Conciliador, IndiceNgramas, jaccard, ngramas
+
+
+def montar(receitas, despesas):
+    return pd.DataFrame({
+        'CURSO': receitas + despesas,
+        'TIPO': ['RECEITA'] * len(receitas) + ['DESPESA'] * len(despesas),
+    })
+
+
+@pytest.mark.parametrize('despesa,receita,criterio', [
+    ('25016 PSICOLOGIA 2', '25016 PSICOLOGIA', 'ID'),
+    ('25016 psicologia', '25016 PSICOLOGIA', 'ID'),
+    ('25018 NUTRICAO EAD', '25018 NUTRIÇÃO EAD', 'similaridade'),
+    ('GESTAO HOSPITALAR TURMA A', '30001 GESTÃO HOSPITALAR TURMA A', 'similaridade'),
+    ('25099 PSICOLOGIA', None, 'sem correspondência'),
+    ('DIREITO', None, 'ambíguo'),
+    ('TÁXI AEROPORTO', None, 'sem correspondência'),
+])
+def test_resolucao_por_id_e_por_similaridade(despesa, receita, criterio):
+    """ID único ganha; sem ID vale o nome; ID inexistente ou empate nunca chuta."""
+    receitas = ['25016 PSICOLOGIA', '25017 DIREITO', '25019 DIREITO',
+                '25018 NUTRIÇÃO EAD', '25018 NUTRIÇÃO UNINGA', '30001 GESTÃO HOSPITALAR TURMA A']
+    conciliador = Conciliador(limiar=0.7)
+    df = conciliador.conciliar(montar(receitas, [despesa]))
+
+    linha = conciliador.relatorio.iloc[0]
+    assert linha['Critério'] == criterio
+    assert (linha['Nº Controle (receita)'] if receita else None) == receita
+    assert df['CURSO'].iloc[-1] == (receita or despesa)
+
+
+def test_indice_igual_a_comparacao_exaustiva():
+    """O filtro de prefixo/tamanho não perde nenhum par acima do limiar."""
+    rnd = random.Random(7)
+    silabas = ['psi', 'co', 'lo', 'gia', 'di', 're', 'to', 'ead', 'nu', 'tri', 'cao']
+    textos = [' '.join(''.join(rnd.choices(silabas, k=3)) for _ in range(2)) for _ in range(300)]
+    indice = IndiceNgramas(textos)
+
+    for consulta in textos[:60] + ['psicologia', 'direito ead', 'x']:
+        esperado = sorted(
+            ((jaccard(ngramas(consulta), ngramas(t)), i) for i, t in enumerate(textos)
+             if jaccard(ngramas(consulta), ngramas(t)) >= 0.6),
+            reverse=True,
+        )
+        assert indice.buscar(consulta, 0.6) == pytest.approx(esperado)
+
+
+def test_despesa_conciliada_entra_na_margem_e_herda_produto():
+    """A despesa digitada com sufixo passa a contar no KPI e recebe o PRODUTO da receita, sem perder o código digitado."""
+    linhas = [
+        ('25016 PSICOLOGIA', '25016 PSICOLOGIA', 'PÓS', 'ANA', 1000.0, '2024-01-05', 'RECEITA'),
+        ('25016 PSICOLOGIA 2', '25016 PSICOLOGIA 2', '', 'GRÁFICA', 200.0, '2024-01-20', 'DESPESA'),
+        ('99999 SEM RECEITA', '99999 SEM RECEITA', '', 'TÁXI', 80.0, '2024-02-03', 'DESPESA'),
+    ]
+    df = pd.DataFrame(linhas, columns=etl.COLUNAS_FINAIS)
+    df['DATA'] = pd.to_datetime(df['DATA'])
+    conciliador = Conciliador()
+
+    df = etl.montar_dataset([df], conciliador)
+
+    assert df['CURSO'].tolist() == ['25016 PSICOLOGIA', '25016 PSICOLOGIA', '99999 SEM RECEITA']
+    assert df['CURSO_ORIGINAL'].tolist() == ['25016 PSICOLOGIA', '25016 PSICOLOGIA 2', '99999 SEM RECEITA']
+    assert isinstance(df['CURSO_ORIGINAL'].dtype, pd.CategoricalDtype)
+    assert df['PRODUTO'].tolist() == ['PÓS', 'PÓS', 'OUTROS / INDEFINIDO']
+    assert etl.montar_cubo(df).query('VALIDO')['VALOR'].sum() == 1200.0
+    assert conciliador.resumo() == [
+        '🔗 Conciliação de Nº Controle: 1 por ID, 0 por similaridade, 1 sem correspondência '
+        '(1 linhas de despesa reatribuídas).'
+    ]
@@ -0,0 +1,338 @@
+import io
+import re
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import benchmark
+import etl
+import instrumentacao
+
+
+def com_shared_strings(conteudo):
+    """Reescreve os textos inline do openpyxl como sharedStrings, na ordem em que aparecem (como o Excel/Sheets)."""
+    indices = {}
+
+    def indexar(m):
+        idx = indices.setdefault(m.group(3), len(indices))
+        return b'<c r="%s"%s t="s"><v>%d</v></c>' % (m.group(1), m.group(2), idx)
+
+    entrada = zipfile.ZipFile(io.BytesIO(conteudo))
+    saida = io.BytesIO()
+    with zipfile.ZipFile(saida, 'w') as zf:
+        for nome in entrada.namelist():
+            xml = entrada.read(nome)
+            if nome.startswith('xl/worksheets/'):
+                xml = re.sub(rb'<c r="(\w+)"((?: s="\d+")?) t="inlineStr"><is><t[^>]*>(.*?)</t></is></c>', indexar, xml)
+            elif nome == '[Content_Types].xml':
+                xml = xml.replace(b'</Types>', b'<Override PartName="/xl/sharedStrings.xml" ContentType='
+                                  b'"application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml" /></Types>')
+            elif nome == 'xl/_rels/workbook.xml.rels':
+                xml = xml.replace(b'</Relationships>', b'<Relationship Type="http://schemas.openxmlformats.org/officeDocument/'
+                                  b'2006/relationships/sharedStrings" Target="sharedStrings.xml" Id="rIdSS" /></Relationships>')
+            zf.writestr(nome, xml)
+        zf.writestr('xl/sharedStrings.xml', b'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                    + b''.join(b'<si><t>%s</t></si>' % t for t in indices) + b'</sst>')
+    return saida.getvalue()
+
+
+def carregar_completo(conteudo):
+    """Caminho original: lê todas as abas e processa uma a uma."""
+    logs = []
+    df_list = []
+    for nome, df in pd.read_excel(io.BytesIO(conteudo), sheet_name=None, engine='openpyxl').items():
+        df_temp = etl.processar_aba(nome, df, logs)
+        if df_temp is not None:
+            df_list.append(df_temp)
+    return etl.montar_dataset(df_list), logs
+
+
+# --- INGESTÃO INCREMENTAL ---
+def test_incremental_igual_ao_carregamento_completo(abas, gerar_xlsx):
+    """A ingestão incremental produz o mesmo dataset e os mesmos logs do caminho completo."""
+    conteudo = gerar_xlsx(abas)
+    df_esperado, logs_esperados = carregar_completo(conteudo)
+
+    df, logs = etl.IngestaoIncremental().carregar(conteudo)
+
+    pd.testing.assert_frame_equal(df, df_esperado)
+    assert logs == logs_esperados
+    assert logs == ["⚠️ Aba 'DESPESAS VAZIA' ignorada: Registros sem 'Nº Controle' válido."]
+    assert df.loc[df['CURSO'] == '99999 SEM RECEITA', 'PRODUTO'].item() == 'OUTROS / INDEFINIDO'
+    assert df.loc[df['TIPO'] == 'DESPESA', 'PRODUTO'].iloc[0] == 'PÓS'
+
+
+def test_incremental_reprocessa_apenas_abas_alteradas(abas, gerar_xlsx):
+    """Só a aba editada é reprocessada e o backfill de PRODUTO é refeito."""
+    ingestao = etl.IngestaoIncremental()
+    ingestao.carregar(gerar_xlsx(abas))
+    versao_inicial = ingestao.versao
+
+    ingestao.carregar(gerar_xlsx(abas))
+    assert ingestao.ultimas_alteradas == []
+    assert ingestao.versao == versao_inicial
+
+    abas['RECEITAS JAN'][1][2] = 'Graduação'
+    conteudo = gerar_xlsx(abas)
+    df, logs = ingestao.carregar(conteudo)
+
+    assert ingestao.ultimas_alteradas == ['RECEITAS JAN']
+    assert ingestao.versao != versao_inicial
+    pd.testing.assert_frame_equal(df, carregar_completo(conteudo)[0])
+    assert df.loc[df['TIPO'] == 'DESPESA', 'PRODUTO'].iloc[0] == 'GRADUAÇÃO'
+
+
+def test_fingerprint_considera_textos_compartilhados(abas, gerar_xlsx):
+    """Trocar um texto do sharedStrings altera o fingerprint apenas da aba que o usa."""
+    antes = etl.fingerprints_abas(com_shared_strings(gerar_xlsx(abas)))
+    abas['PAGAMENTOS JAN'][2][2] = 'Pousada'
+    depois = etl.fingerprints_abas(com_shared_strings(gerar_xlsx(abas)))
+
+    assert antes['PAGAMENTOS JAN'] != depois['PAGAMENTOS JAN']
+    assert antes['RECEITAS JAN'] == depois['RECEITAS JAN']
+
+
+def test_texto_novo_na_primeira_aba_nao_invalida_as_seguintes(abas, gerar_xlsx):
+    """Um texto novo desloca os índices do sharedStrings das abas seguintes, que não são reprocessadas."""
+    abas['PAGAMENTOS FEV'] = [['DATA', 'CONTROLE', 'FORNECEDOR', 'VALOR'], [datetime(2024, 2, 3), '25016 PSICOLOGIA UNINGA', 'Hotel', -80.0]]
+    ingestao = etl.IngestaoIncremental()
+    conteudo = com_shared_strings(gerar_xlsx(abas))
+    with zipfile.ZipFile(io.BytesIO(conteudo)) as zf:
+        assert 'xl/sharedStrings.xml' in zf.namelist()
+    ingestao.carregar(conteudo)
+    antes = etl.fingerprints_abas(conteudo)
+
+    abas['RECEITAS JAN'].append([datetime(2024, 1, 12), '25018 DIREITO', 'Extensão', 'Davi', 'R$ 10,00'])
+    conteudo = com_shared_strings(gerar_xlsx(abas))
+    df, _ = ingestao.carregar(conteudo)
+    depois = etl.fingerprints_abas(conteudo)
+
+    assert ingestao.ultimas_alteradas == ['RECEITAS JAN']
+    assert {n for n in antes if antes[n] != depois[n]} == {'RECEITAS JAN'}
+    pd.testing.assert_frame_equal(df, carregar_completo(conteudo)[0])
+
+
+def test_fingerprint_ignora_estilos_que_nao_sao_formato_de_numero(abas, gerar_xlsx):
+    """Fontes e cores no styles.xml não mudam o fingerprint; o formato de número, sim."""
+    conteudo = gerar_xlsx(abas)
+    base = etl.fingerprints_abas(conteudo)
+
+    def trocar_estilos(antigo, novo):
+        saida = io.BytesIO()
+        with zipfile.ZipFile(io.BytesIO(conteudo)) as entrada, zipfile.ZipFile(saida, 'w') as zf:
+            for nome in entrada.namelist():
+                xml = entrada.read(nome)
+                zf.writestr(nome, xml.replace(antigo, novo) if nome == 'xl/styles.xml' else xml)
+        return etl.fingerprints_abas(saida.getvalue())
+
+    assert trocar_estilos(b'<sz val="11" />', b'<sz val="14" />') == base
+    assert trocar_estilos(b'formatCode="yyyy-mm-dd h:mm:ss"', b'formatCode="0.00"') != base
+
+
+# --- SNAPSHOT EM DISCO ---
+def test_snapshot_ida_e_volta(abas, tmp_path, gerar_xlsx):
+    """O snapshot devolve exatamente o dataset e os logs gravados."""
+    ingestao = etl.IngestaoIncremental()
+    df, logs = ingestao.carregar(gerar_xlsx(abas))
+    caminho = str(tmp_path / 'dataset.feather')
+
+    assert etl.salvar_snapshot(df, logs, caminho=caminho, versao=ingestao.versao)
+    df_lido, logs_lidos, versao = etl.ler_snapshot(caminho)
+
+    pd.testing.assert_frame_equal(df_lido, df)
+    assert logs_lidos == logs
+    assert versao == ingestao.versao
+
+
+def test_snapshot_incompativel_e_descartado(abas, tmp_path, monkeypatch, gerar_xlsx):
+    """Snapshot de outra versão, corrompido ou inexistente não é carregado."""
+    df, logs = etl.IngestaoIncremental().carregar(gerar_xlsx(abas))
+    caminho = tmp_path / 'dataset.feather'
+    assert etl.ler_snapshot(str(caminho)) is None
+
+    etl.salvar_snapshot(df, logs, caminho=str(caminho))
+    monkeypatch.setattr(etl, 'SNAPSHOT_VERSAO', etl.SNAPSHOT_VERSAO + 1)
+    assert etl.ler_snapshot(str(caminho)) is None
+
+    caminho.write_bytes(b'lixo')
+    assert etl.ler_snapshot(str(caminho)) is None
+
+
+# --- CODIFICAÇÃO CATEGÓRICA ---
+def test_dataset_categorico_com_indice_estavel(abas, gerar_xlsx):
+    """Colunas de texto saem como categorias ordenadas e TIPO com dois códigos fixos."""
+    df, _ = etl.IngestaoIncremental().carregar(gerar_xlsx(abas))
+
+    for col in etl.COLUNAS_CATEGORICAS:
+        assert isinstance(df[col].dtype, pd.CategoricalDtype)
+    assert df['TIPO'].cat.categories.tolist() == ['DESPESA', 'RECEITA']
+    assert df['CURSO'].cat.categories.tolist() == sorted(df['CURSO'].astype(str).unique())
+
+
+def test_filtros_por_codigo_equivalem_a_isin(abas, gerar_xlsx):
+    """mascara_categorias e valores_presentes reproduzem isin/unique sobre o texto."""
+    df, _ = etl.IngestaoIncremental().carregar(gerar_xlsx(abas))
+    texto = df['CURSO'].astype(str)
+    sel = ['25016 PSICOLOGIA UNINGA', 'INEXISTENTE']
+
+    assert (etl.mascara_categorias(df['CURSO'], sel) == texto.isin(sel)).all()
+    assert not etl.mascara_categorias(df['CURSO'], []).any()
+
+    receitas = df[df['TIPO'] == 'RECEITA']
+    assert etl.valores_presentes(receitas['CURSO']) == sorted(receitas['CURSO'].astype(str).unique())
+
+
+# --- LEITOR EM STREAMING ---
+@pytest.mark.parametrize('bloco, compartilhados', [(None, False), (64, False), (200, True)])
+def test_leitor_streaming_igual_ao_read_excel(gerar_xlsx, monkeypatch, bloco, compartilhados):
+    """Colunas podadas, linhas vazias e tipos mistos dão o mesmo resultado do read_excel."""
+    if bloco:
+        # Blocos menores que uma linha obrigam o leitor a juntar pedaços até um </row>
+        monkeypatch.setattr(etl, 'BLOCO_XML', bloco)
+    abas = {
+        'RECEBIMENTOS': [
+            ['OBS', 'Valor', 'Nº Controle', None, 'Data', 'Nome', 'Extra', 'Extra'],
+            ['x', 10, 25016, 'lixo', datetime(2024, 3, 1), 'Ana', 1, 2],
+            [None, None, None, None, None, None, None, None],
+            ['só obs', None, None, None, None, None, None, None],
+            [None, 'R$ 2.000,00', '25017 DIREITO', None, 'sem data', 'Bia', None, None],
+            [None, 7.5, 'NaN', None, datetime(2024, 3, 2), None, None, None],
+            [None, None, None, None, None, None, None, None],
+            [None, None, None, None, None, None, 'só extra', None],
+            [None, None, None, None, None, None, None, None],
+        ],
+        'SAIDAS': [
+            ['VALOR PAGO', 'CURSO'],
+            [100, '25016'],
+            [200, '25017 DIREITO'],
+        ],
+        'DESPESAS SEM COLUNAS': [['A', 'B'], [1, 2]],
+        'DESPESAS SEM CABECALHO': [],
+        'OUTRA': [['VALOR', 'CONTROLE'], [1, 'X']],
+    }
+    conteudo = gerar_xlsx(abas)
+    if compartilhados:
+        conteudo = com_shared_strings(conteudo)
+
+    esperado = pd.read_excel(io.BytesIO(conteudo), sheet_name='RECEBIMENTOS', engine='openpyxl')
+    for nome, df in etl.ler_abas(conteudo, ['RECEBIMENTOS']):
+        assert list(df.columns) == ['Valor', 'Nº Controle', 'Data', 'Nome']
+        pd.testing.assert_frame_equal(df, esperado[list(df.columns)])
+
+    df_esperado, logs_esperados = carregar_completo(conteudo)
+    df, logs = etl.IngestaoIncremental().carregar(conteudo)
+    pd.testing.assert_frame_equal(df, df_esperado)
+    assert logs == logs_esperados
+
+
+# --- PROCESSAMENTO PARALELO ---
+def test_modo_paralelo_igual_ao_serial(abas, monkeypatch, gerar_xlsx):
+    """O pool de processos devolve o mesmo dataset e os mesmos logs, na mesma ordem."""
+    monkeypatch.setattr(etl, 'MIN_ABAS_PARALELO', 1)
+    abas['DESPESAS FEV'] = [['DATA', 'CONTROLE', 'VALOR'], [datetime(2024, 2, 1), 'NULL', 5]]
+    conteudo = gerar_xlsx(abas)
+
+    df_serial, logs_serial = etl.IngestaoIncremental(workers=1).carregar(conteudo)
+    df_paralelo, logs_paralelo = etl.IngestaoIncremental(workers=2).carregar(conteudo)
+
+    pd.testing.assert_frame_equal(df_paralelo, df_serial)
+    assert logs_paralelo == logs_serial
+    assert len(logs_paralelo) == 2
+
+
+# --- ATUALIZAÇÃO EM SEGUNDO PLANO ---
+def test_atualizador_serve_dados_antigos_enquanto_recarrega():
+    """Com os dados vencidos, obter() devolve o último dataset e troca após a recarga."""
+    liberar = threading.Event()
+    antigos = (pd.DataFrame({'VALOR': [1.0]}), [], 'v1')
+    novos = (pd.DataFrame({'VALOR': [2.0]}), [], 'v2')
+
+    def carregar():
+        liberar.wait(5)
+        return novos
+
+    atualizador = etl.AtualizadorDados(carregar, ttl=60, inicial=antigos, atualizado_em=time.time() - 120)
+    assert atualizador.obter() is antigos
+    assert atualizador.atualizando
+
+    liberar.set()
+    atualizador._thread.join(5)
+    assert atualizador.obter() is novos
+    assert atualizador.idade() < 60
+
+
+def test_atualizador_semente_sem_horario_conta_como_recente():
+    """inicial sem atualizado_em é servido como dado novo, sem recarregar nem quebrar."""
+    chamadas = []
+    antigos = (pd.DataFrame({'VALOR': [1.0]}), [], 'v1')
+    atualizador = etl.AtualizadorDados(lambda: chamadas.append(1), ttl=60, inicial=antigos)
+
+    assert atualizador.obter() is antigos
+    assert 0 <= atualizador.idade() < 60
+    assert not atualizador.atualizando and chamadas == []
+
+
+def test_atualizador_mantem_ultimo_dado_bom_em_falha():
+    """Uma recarga com erro não substitui os dados; sem dados, devolve o Erro Crítico."""
+    def falhar():
+        raise ConnectionError('sem rede')
+
+    antigos = (pd.DataFrame({'VALOR': [1.0]}), [], 'v1')
+    atualizador = etl.AtualizadorDados(falhar, ttl=60, inicial=antigos, atualizado_em=time.time() - 120)
+    atualizador.obter()
+    atualizador._thread.join(5)
+    assert atualizador.obter() is antigos
+    assert atualizador.ultimo_erro == 'sem rede'
+
+    df, logs, versao = etl.AtualizadorDados(falhar, ttl=60).obter()
+    assert df.empty and versao is None
+    assert logs == ['Erro Crítico: sem rede']
+
+
+def test_atualizador_fonte_sem_mudanca_renova_dados_atuais():
+    """carregar() devolvendo None (fonte não mudou) mantém o dataset e zera a idade."""
+    antigos = (pd.DataFrame({'VALOR': [1.0]}), [], 'v1')
+    atualizador = etl.AtualizadorDados(lambda: None, ttl=60, inicial=antigos, atualizado_em=time.time() - 120)
+    atualizador.obter()
+    atualizador._thread.join(5)
+    assert atualizador.obter() is antigos
+    assert atualizador.idade() < 60 and atualizador.ultimo_erro is None
+
+
+# --- PLANILHAS SINTÉTICAS DO BENCHMARK ---
+@pytest.mark.parametrize('layout', sorted(benchmark.LAYOUTS))
+def test_planilha_sintetica_reconhecida(layout, tmp_path):
+    """Todos os layouts do gerador passam pelo detector de colunas e descartam o lixo."""
+    caminho = benchmark.gerar_planilha(str(tmp_path / 'bench.xlsx'), linhas=400, abas=4, layout=layout, lixo=0.2)
+    with open(caminho, 'rb') as f:
+        df, _ = etl.IngestaoIncremental().carregar(f.read())
+
+    assert 0 < len(df) < 400
+    assert set(df['TIPO'].unique()) == {'RECEITA', 'DESPESA'}
+    assert not df['CURSO'].isin(etl.VALORES_INVALIDOS).any()
+    assert (df['VALOR'] > 0).all()
+
+
+# --- INSTRUMENTAÇÃO ---
+def test_carga_registra_etapas_com_linhas(abas, gerar_xlsx):
+    """Dentro de um rastreio, a carga registra tempo, memória e linhas por aba."""
+    with instrumentacao.rastrear('carga') as rastreio:
+        df, _ = etl.IngestaoIncremental().carregar(gerar_xlsx(abas))
+
+    assert instrumentacao.ultimo('carga') is rastreio
+    etapas = {(e['etapa'], e.get('aba')): e for e in rastreio.etapas}
+    assert etapas[('leitura xlsx', 'RECEITAS JAN')]['linhas_lidas'] == 3
+    assert etapas[('limpeza', 'RECEITAS JAN')]['linhas_validas'] == 2
+    assert etapas[('concat', None)]['linhas'] == len(df)
+    assert all('segundos' in e and 'memoria_delta_mb' in e for e in rastreio.etapas)
+
+
+def test_etapa_sem_rastreio_nao_registra():
+    """Fora de um rastreio, etapa() é um no-op que ainda aceita anotações."""
+    with instrumentacao.etapa('solta') as reg:
+        reg['linhas'] = 10
+    assert instrumentacao.ultimo('solta') is None
@@ -0,0 +1,99 @@
+import io
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from openpyxl import load_workbook
+
+import analise
+import exportacao
+from web_app import format_currency
+
+
+@pytest.fixture
+def lancamentos():
+    n = 1_000
+    rnd = np.random.default_rng(3)
+    cursos = rnd.choice(['25016 PSICOLOGIA', '25017 DIREITO & CIA', '25018 <NUTRIÇÃO>'], n)
+    df = pd.DataFrame({
+        'CURSO': pd.Categorical(cursos),
+        'CURSO_ORIGINAL': pd.Categorical(np.char.add(cursos, rnd.choice(['', ' 2'], n))),
+        'PRODUTO': pd.Categorical(rnd.choice(['PÓS', 'MBA'], n)),
+        'ENTIDADE': pd.Categorical(rnd.choice(['ANA', 'BIA', None], n)),
+        'VALOR': rnd.uniform(0, 2_000_000, n).round(2),
+        'DATA': pd.Timestamp('2024-01-01') + pd.to_timedelta(rnd.integers(0, 300, n), unit='D'),
+        'TIPO': pd.Categorical(rnd.choice(['RECEITA', 'DESPESA'], n)),
+    })
+    df.loc[::97, 'DATA'] = pd.NaT
+    return df
+
+
+def exportar_bytes(lotes, formato, moeda=('Valor',)):
+    with exportacao.exportar(lotes, formato, moeda) as arquivo:
+        return arquivo.read()
+
+
+def test_formatar_brl_igual_ao_format_currency():
+    valores = [0.0, 0.5, 1234.5, -9876543.219, 1e12, float('nan')]
+    assert exportacao.formatar_brl(valores) == [format_currency(v) for v in valores]
+
+
+@pytest.mark.parametrize('formato', sorted(exportacao.FORMATOS))
+def test_exportacao_em_lotes_igual_a_tabela_inteira(lancamentos, formato):
+    """Lotes pequenos geram o mesmo conteúdo que um lote só, na ordem da tabela detalhada."""
+    ordem = analise.ordem_detalhe(lancamentos, 'Valor (maior)')
+    mask = (lancamentos['TIPO'] == 'RECEITA').to_numpy()
+    posicoes = ordem[mask[ordem]]
+    esperado = lancamentos.iloc[posicoes][list(analise.COLUNAS_DETALHE)].rename(columns=analise.COLUNAS_DETALHE)
+
+    dados = exportar_bytes(exportacao.lotes_detalhe(lancamentos, posicoes, tamanho=64), formato)
+    assert dados == exportar_bytes(exportacao.lotes_detalhe(lancamentos, posicoes, tamanho=len(posicoes)), formato) \
+        or formato == 'parquet'  # Parquet grava um row group por lote
+
+    if formato == 'csv':
+        assert dados.startswith(b'\xef\xbb\xbfData;')
+        lido = pd.read_csv(io.BytesIO(dados), sep=';', encoding='utf-8-sig', dtype=str, keep_default_na=False)
+        assert lido['Valor'].tolist() == [format_currency(v) for v in esperado['Valor']]
+        assert lido['Data'].tolist() == esperado['Data'].dt.strftime('%d/%m/%Y').fillna('').tolist()
+    elif formato == 'xlsx':
+        ws = load_workbook(io.BytesIO(dados), read_only=True).active
+        linhas = list(ws.iter_rows(values_only=True))
+        assert linhas[0] == tuple(esperado.columns)
+        assert [linha[4] for linha in linhas[1:]] == esperado['Valor'].tolist()
+        assert [linha[1] for linha in linhas[1:]] == esperado['Nº Controle'].astype(str).tolist()
+        assert [linha[2] for linha in linhas[1:]] == esperado['Nº Controle (digitado)'].astype(str).tolist()
+        assert [linha[0] for linha in linhas[1:]] == [None if pd.isna(d) else d.to_pydatetime() for d in esperado['Data']]
+        assert load_workbook(io.BytesIO(dados)).active['E2'].number_format == '"R$" #,##0.00'
+    else:
+        arquivo = pq.ParquetFile(io.BytesIO(dados))
+        assert arquivo.num_row_groups == -(-len(posicoes) // 64)
+        lido = arquivo.read().to_pandas()
+        assert lido['Valor'].tolist() == esperado['Valor'].tolist()
+        assert lido['Cliente/Fornecedor'].isna().sum() == esperado['Cliente/Fornecedor'].isna().sum()
+
+
+@pytest.mark.parametrize('formato', ['csv', 'xlsx'])
+def test_memoria_limitada_pelo_lote(lancamentos, formato, monkeypatch):
+    """O pico de memória acompanha o tamanho do lote (e do buffer do arquivo), não o da seleção."""
+    monkeypatch.setattr(exportacao, 'LIMITE_MEMORIA_MB', 0.25)
+    grande = pd.concat([lancamentos] * 20, ignore_index=True)
+    posicoes = np.arange(len(grande))
+
+    def pico(tamanho):
+        tracemalloc.start()
+        exportacao.exportar(exportacao.lotes_detalhe(grande, posicoes, tamanho), formato, ['Valor']).close()
+        _, maximo = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return maximo
+
+    assert pico(1_000) * 4 < pico(len(grande))
+
+
+def test_resumo_por_controle():
+    df_chart = pd.DataFrame({'CURSO': ['A', 'B'], 'DESPESA': [50.0, 10.0], 'RECEITA': [100.0, 300.0]})
+    resumo = exportacao.resumo_por_controle(df_chart)
+    assert resumo.to_dict('list') == {
+        'Nº Controle': ['B', 'A'], 'Receita': [300.0, 100.0], 'Despesa': [10.0, 50.0], 'Resultado': [290.0, 50.0],
+    }
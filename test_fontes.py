@@ -0,0 +1,114 @@
+import http.server
+import os
+import threading
+from datetime import datetime
+
+import pytest
+
+import etl
+import fontes
+
+
+CSV_PAGAMENTOS = (
+    'Data;Controle;Fornecedor;Valor\n'
+    '20/01/2024;25016 PSICOLOGIA UNINGA;Gráfica;"-200,00"\n'
+    '03/02/2024;25016 PSICOLOGIA UNINGA;Hotel;"-1.050,25"\n'
+).encode('utf-8')
+
+
+@pytest.fixture
+def diretorio(tmp_path, gerar_xlsx):
+    (tmp_path / 'receitas.xlsx').write_bytes(gerar_xlsx({'RECEITAS JAN': [
+        ['DATA PAGAMENTO', 'Nº CONTROLE PADRONIZADO', 'PRODUTO', 'CLIENTE', 'VALOR'],
+        [datetime(2024, 1, 5), '25016 PSICOLOGIA UNINGA', 'Pós', 'Ana', 'R$ 1.500,50'],
+    ]}))
+    (tmp_path / 'PAGAMENTOS 2024.csv').write_bytes(CSV_PAGAMENTOS)
+    (tmp_path / 'anotacoes.txt').write_text('ignorado')
+    return tmp_path
+
+
+def test_fonte_local_so_devolve_conteudo_quando_muda(diretorio):
+    """Sem mudança não há leitura; regravar igual decide pelo hash; só confirmar() grava o estado."""
+    fonte = fontes.FonteLocal(str(diretorio))
+
+    conteudo, info = fonte.buscar()
+    assert sorted(conteudo) == ['PAGAMENTOS 2024.csv', 'receitas.xlsx']
+    assert info['status'] == 'novo' and info['bytes'] == sum(map(len, conteudo.values()))
+    assert fonte.buscar()[0] is not None  # carga não confirmada: busca de novo
+    fonte.confirmar()
+    assert fonte.buscar() == (None, fonte.historico[-1])
+    assert fonte.historico[-1]['status'] == 'sem mudança (arquivos)'
+
+    csv = diretorio / 'PAGAMENTOS 2024.csv'
+    os.utime(csv, ns=(csv.stat().st_atime_ns, csv.stat().st_mtime_ns + 10**9))
+    assert fonte.buscar()[0] is None
+    assert fonte.historico[-1]['status'] == 'sem mudança (hash)'
+
+    csv.write_bytes(CSV_PAGAMENTOS + b'04/02/2024;25016 PSICOLOGIA UNINGA;Taxi;"-10,00"\n')
+    assert fonte.buscar()[0] is not None
+
+
+def test_csv_e_xlsx_do_diretorio_entram_no_dataset(diretorio):
+    """CSV com ';', datas dd/mm e valores BRL vira uma aba; só ele é reprocessado ao mudar."""
+    fonte = fontes.FonteLocal(str(diretorio))
+    ingestao = etl.IngestaoIncremental(workers=1)
+    df, _ = ingestao.carregar(fonte.buscar()[0])
+
+    despesas = df[df['TIPO'] == 'DESPESA']
+    assert despesas['VALOR'].tolist() == [200.0, 1050.25]
+    assert despesas['DATA'].dt.strftime('%Y-%m-%d').tolist() == ['2024-01-20', '2024-02-03']
+    assert (despesas['PRODUTO'] == 'PÓS').all()
+    assert sorted(ingestao.ultimas_alteradas) == ['PAGAMENTOS 2024', 'RECEITAS JAN']
+
+    versao = ingestao.versao
+    (diretorio / 'PAGAMENTOS 2024.csv').write_bytes(CSV_PAGAMENTOS.replace(b'-200,00', b'-300,00'))
+    df, _ = ingestao.carregar(fonte.buscar()[0])
+    assert ingestao.ultimas_alteradas == ['PAGAMENTOS 2024']
+    assert ingestao.versao != versao
+    assert df.loc[df['TIPO'] == 'DESPESA', 'VALOR'].sum() == 1350.25
+
+
+class _Servidor(http.server.BaseHTTPRequestHandler):
+    corpo = b'planilha v1'
+    etag = '"v1"'
+
+    def do_GET(self):
+        if self.etag and self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if self.etag:
+            self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(self.corpo)))
+        self.end_headers()
+        self.wfile.write(self.corpo)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def servidor():
+    handler = type('Handler', (_Servidor,), {})
+    httpd = http.server.HTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield handler, f'http://127.0.0.1:{httpd.server_port}/export'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.mark.parametrize('etag,status', [('"v1"', 'sem mudança (304)'), (None, 'sem mudança (hash)')])
+def test_fonte_http_requisicao_condicional(servidor, etag, status):
+    """Com ETag o servidor responde 304; sem ETag o hash do corpo evita o parse."""
+    handler, url = servidor
+    handler.etag = etag
+    fonte = fontes.FonteHTTP(url, timeout=5)
+
+    assert fonte.buscar()[0] == b'planilha v1'
+    fonte.confirmar()
+    conteudo, info = fonte.buscar()
+    assert conteudo is None and info['status'] == status
+
+    handler.corpo, handler.etag = b'planilha v2', etag and '"v2"'
+    assert fonte.buscar()[0] == b'planilha v2'
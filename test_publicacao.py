@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+import etl
+import publicacao
+
+
+@pytest.fixture
+def carga(abas, gerar_xlsx):
+    ingestao = etl.IngestaoIncremental(workers=1)
+    df, logs = ingestao.carregar(gerar_xlsx(abas))
+    return df, logs, ingestao
+
+
+def test_publicacao_versionada_e_leitor(carga, tmp_path):
+    """O leitor só relê quando o ponteiro muda; o cubo publicado é o mesmo do montar_cubo."""
+    df, logs, ingestao = carga
+    destino = str(tmp_path)
+    leitor = publicacao.LeitorPublicacao(destino)
+    with pytest.raises(FileNotFoundError):
+        leitor.carregar()
+
+    assert publicacao.publicar(df, logs, ingestao.versao, destino, ingestao.conciliador.relatorio)
+    assert not publicacao.publicar(df, logs, ingestao.versao, destino)
+    lido, logs_lidos, versao = leitor.carregar()
+    pd.testing.assert_frame_equal(lido, df[etl.COLUNAS_FINAIS])
+    assert (logs_lidos, versao) == (logs, ingestao.versao)
+    assert leitor.carregar() is None
+    pd.testing.assert_frame_equal(publicacao.ler_agregado(destino, versao, 'cubo'), etl.montar_cubo(df))
+
+    for n in range(4):
+        publicacao.publicar(df.iloc[:n + 1], logs, f'v{n}', destino, manter=2)
+    assert publicacao.versao_publicada(destino) == 'v3'
+    assert sorted(os.listdir(destino)) == ['ATUAL', 'v2', 'v3']
+    assert len(leitor.carregar()[0]) == 4
+
+
+def test_worker_sem_streamlit_e_sem_reprocessar(abas, tmp_path, gerar_xlsx):
+    """A linha de comando não importa Streamlit/Plotly e não republica a mesma planilha."""
+    fonte = tmp_path / 'fonte'
+    fonte.mkdir()
+    (fonte / 'planilha.xlsx').write_bytes(gerar_xlsx(abas))
+    destino = tmp_path / 'publicado'
+    ambiente = {**os.environ, 'OHANA_FONTE_DIR': str(fonte), 'OHANA_ETL_WORKERS': '1'}
+    codigo = (
+        "import sys, publicacao; publicacao.main(sys.argv[1:]); "
+        "print(sorted({m.split('.')[0] for m in sys.modules} & {'streamlit', 'plotly'}))"
+    )
+
+    def rodar():
+        saida = subprocess.run([sys.executable, '-c', codigo, '--destino', str(destino)], env=ambiente,
+                               cwd=os.path.dirname(os.path.abspath(publicacao.__file__)),
+                               capture_output=True, text=True, check=True)
+        return saida.stdout.splitlines()
+
+    primeira = rodar()
+    assert 'publicada versão' in primeira[0] and primeira[1] == '[]'
+    assert 'nada a publicar' in rodar()[0]
+    assert publicacao.manifesto(str(destino))['linhas'] == 4
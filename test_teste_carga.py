@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import teste_carga
+
+
+def test_resumo_com_percentis_e_erros():
+    """Erros ficam fora dos percentis; throughput conta só reruns bem-sucedidos."""
+    medicoes = [{'sessao': 0, 'acao': 'login', 'segundos': s / 100, 'erro': None} for s in range(1, 101)]
+    medicoes.append({'sessao': 1, 'acao': 'login', 'segundos': 9.0, 'erro': 'KeyError'})
+    r = teste_carga.resumir(2, medicoes, duracao=10.0, memoria=[100.0, 180.0, 150.0])
+
+    assert r['reruns'] == 100 and len(r['erros']) == 1
+    assert r['throughput'] == 10.0
+    assert r['geral']['p50'] == pytest.approx(0.505)
+    assert r['geral']['p99'] == pytest.approx(0.9901)
+    assert (r['memoria_pico_mb'], r['memoria_final_mb']) == (180.0, 150.0)
+    assert 'login' in teste_carga.formatar(r)
+
+
+def test_sessoes_concorrentes_sem_erros(tmp_path):
+    """Duas sessões percorrem o roteiro inteiro em paralelo sobre a planilha sintética."""
+    saida = subprocess.run(
+        [sys.executable, 'teste_carga.py', '--sessoes', '2', '--linhas', '600', '--rodadas', '1', '--dir', str(tmp_path)],
+        cwd=os.path.dirname(os.path.abspath(teste_carga.__file__)), capture_output=True, text=True, timeout=300,
+    )
+    assert saida.returncode == 0, saida.stderr[-2000:]
+    assert 'Sessões: 2  reruns: 24  erros: 0' in saida.stdout
+    assert 'tabela detalhada' in saida.stdout
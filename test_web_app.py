@@ -1,6 +1,8 @@
 import pytest
+import numpy as np
 import pandas as pd
 from web_app import limpar_valor, extrair_id, gerar_sugestao, normalizar_texto
+from normalizacao import normalizar_controle, normalizar_maiusculo
 
 # --- TESTES DE LIMPEZA FINANCEIRA ---
 def test_limpar_valor_moeda():
@@ -35,4 +37,54 @@ def test_normalizar_texto_acentos():
 
 def test_normalizar_texto_vazio():
     """Valida comportamento com valores nulos."""
-    assert normalizar_texto(None) == ""
\ No newline at end of file
+    assert normalizar_texto(None) == ""
+
+# --- TESTES DE NORMALIZAÇÃO EM SÉRIES (UMA VEZ POR VALOR DISTINTO) ---
+def cadeia_antiga(serie):
+    """Cadeia de .str usada no ETL antes do motor de normalização."""
+    return serie.fillna('').astype(str).str.strip().str.upper().str.replace(r'\.0$', '', regex=True)
+
+def limpar_valor_antigo(serie):
+    """limpar_valor do ETL antes do motor: tudo vira texto e é convertido de novo."""
+    return pd.to_numeric(
+        serie.astype(str).str.replace('R$', '', regex=False).str.replace('.', '', regex=False).str.replace(',', '.', regex=False),
+        errors='coerce'
+    ).fillna(0)
+
+@pytest.fixture
+def serie_mista():
+    return pd.Series(
+        [25016.0, None, np.nan, pd.NaT, '  25016 psicologia ', '25016 psicologia', 'pós ', ' pós', 25016.0, 7, 'abc.0', '   '],
+        index=range(10, 22), dtype=object, name='CONTROLE'
+    )
+
+def test_normalizar_controle_serie_igual_cadeia_antiga(serie_mista):
+    """Floats (25016.0), nulos, textos com espaços e repetidos: mesmo resultado da cadeia antiga."""
+    resultado = normalizar_controle(serie_mista)
+    pd.testing.assert_series_equal(resultado, cadeia_antiga(serie_mista))
+    assert resultado.tolist()[:4] == ['25016', '', '', '']
+
+def test_normalizar_controle_serie_float():
+    """Coluna inteiramente numérica com vazios (float64) também bate com a cadeia antiga."""
+    serie = pd.Series([25016.0, np.nan, 25017.0, 25016.0])
+    assert normalizar_controle(serie).tolist() == cadeia_antiga(serie).tolist() == ['25016', '', '25017', '25016']
+
+def test_normalizar_maiusculo_serie_igual_cadeia_antiga(serie_mista):
+    """Igual à cadeia antiga sem a remoção do ".0"."""
+    antigo = serie_mista.fillna('').astype(str).str.strip().str.upper()
+    pd.testing.assert_series_equal(normalizar_maiusculo(serie_mista), antigo)
+    assert normalizar_maiusculo(serie_mista).tolist()[6:8] == ['PÓS', 'PÓS']
+
+def test_limpar_valor_serie_igual_escalar():
+    """Na série, cada valor dá o mesmo resultado da versão escalar."""
+    serie = pd.Series(['R$ 1.500,50', None, np.nan, pd.NaT, ' 300 ', 'texto', 'R$ 1.500,50', 2500], dtype=object)
+    resultado = limpar_valor(serie)
+    assert resultado.dtype == 'float64'
+    assert resultado.tolist() == [limpar_valor(v) for v in serie] == [1500.5, 0.0, 0.0, 0.0, 300.0, 0.0, 1500.5, 2500.0]
+    pd.testing.assert_series_equal(resultado, limpar_valor_antigo(serie))
+
+def test_limpar_valor_serie_numeros_em_coluna_de_texto():
+    """Mudança intencional: números numa coluna VALOR de texto não são mais convertidos em texto e relidos."""
+    serie = pd.Series(['R$ 300,00', 1500.5, 1500.5], dtype=object)
+    assert limpar_valor_antigo(serie).tolist() == [300.0, 15005.0, 15005.0]
+    assert limpar_valor(serie).tolist() == [300.0, 1500.5, 1500.5]
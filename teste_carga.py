@@ -0,0 +1,275 @@
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import benchmark
+import etl
+import instrumentacao
+
+# ==============================================================================
+# TESTE DE CARGA (SESSÕES CONCORRENTES COM AppTest)
+# ==============================================================================
+# Uso: python teste_carga.py --sessoes 20 50 --linhas 50000 --rodadas 3 --saida carga.txt
+#
+# Cada sessão é um AppTest do web_app.py numa thread própria, todas no mesmo
+# processo: os caches st.cache_resource (dataset, cubo, CacheDerivados) são
+# compartilhados como no servidor real, e cada rerun disputa o GIL com os
+# demais. A planilha é sintética (benchmark.gerar_planilha) e lida de um
+# diretório local, sem rede. A latência medida é a do rerun completo do
+# script mais a montagem da árvore de elementos pelo AppTest, que faz as
+# vezes da serialização para o navegador.
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web_app.py')
+SENHA = 'teste-de-carga'
+TIMEOUT_RERUN = 120
+
+
+def preparar_ambiente(linhas, diretorio):
+    """Gera (uma vez) a planilha sintética e aponta fonte, snapshot e senha para o teste."""
+    import streamlit as st
+    from streamlit.runtime.secrets import Secrets
+
+    fonte = os.path.join(diretorio, f'fonte_{linhas}')
+    os.makedirs(fonte, exist_ok=True)
+    caminho = os.path.join(fonte, 'planilha.xlsx')
+    if not os.path.exists(caminho):
+        print(f'Gerando {caminho}...', flush=True)
+        benchmark.gerar_planilha(caminho, linhas=linhas, abas=24)
+    os.environ['OHANA_FONTE_DIR'] = fonte
+    os.environ.pop('OHANA_PUBLICACAO_DIR', None)
+    # Snapshot num diretório descartável: toda execução parte a frio
+    etl.SNAPSHOT_PATH = os.path.join(tempfile.mkdtemp(dir=diretorio), 'dataset.feather')
+
+    # Secrets globais em vez de AppTest.secrets: o AppTest troca e restaura
+    # st.secrets a cada run, o que não é seguro com várias sessões em paralelo
+    segredos = Secrets()
+    segredos._secrets = {'passwords': {'admin': SENHA}}
+    st.secrets = segredos
+    _preparar_apptest()
+
+
+def _preparar_apptest():
+    # Pelo mesmo motivo: cada AppTest instala um Runtime de mentira e o apaga
+    # (Runtime._instance = None) ao terminar, derrubando os reruns das outras
+    # sessões ainda em andamento; um runtime de teste fixo fica como reserva.
+    # E cada run compila o script num ScriptCache novo (compilar em paralelo
+    # quebra o ast.parse do 3.11); o servidor real compila uma vez só.
+    from unittest.mock import MagicMock
+
+    from streamlit.runtime import Runtime
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    script_cache = app_test.ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+
+    reserva = MagicMock(spec=Runtime)
+    reserva.media_file_mgr = app_test.MediaFileManager(app_test.MemoryMediaFileStorage('/mock/media'))
+    if hasattr(app_test, 'DataframeSourceManager'):  # Streamlit >= 1.61
+        reserva.dataframe_source_mgr = app_test.DataframeSourceManager()
+    reserva.cache_storage_manager = app_test.MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: cls._instance or reserva)
+    Runtime.exists = classmethod(lambda cls: True)
+
+
+# ==============================================================================
+# ROTEIRO DE UMA SESSÃO
+# ==============================================================================
+def _rerun(elemento):
+    elemento.run(timeout=TIMEOUT_RERUN)
+
+
+def _checkbox(at, prefixo):
+    return next(c for c in at.checkbox if c.label.startswith(prefixo))
+
+
+def _botao(at, trecho):
+    return next(b for b in at.button if trecho in b.label)
+
+
+def _selecionar(at, rnd, rotulo, maximo):
+    caixa = next(m for m in at.multiselect if m.label == rotulo)
+    for opcao in rnd.sample(list(caixa.options), min(maximo, len(caixa.options))):
+        caixa.select(opcao)
+    return caixa
+
+
+def roteiro(rnd):
+    """Ações de um analista, na ordem: (nome, função que recebe o AppTest e dispara um rerun)."""
+    def abrir_detalhe(at):
+        at.session_state['detalhe_aberto'] = True
+        _rerun(at)
+
+    def fechar_detalhe(at):
+        at.session_state['detalhe_aberto'] = False
+        _rerun(at)
+
+    return [
+        ('produtos: desmarcar todos', lambda at: _rerun(_checkbox(at, 'Selecionar TODOS os Produtos').uncheck())),
+        ('produtos: selecionar', lambda at: _rerun(_selecionar(at, rnd, 'Selecione Produtos', 2))),
+        ('controles: desmarcar todos', lambda at: _rerun(_checkbox(at, 'Selecionar TODOS os Controles').uncheck())),
+        ('controles: selecionar', lambda at: _rerun(_selecionar(at, rnd, 'Selecione Nº Controle', 3))),
+        ('botão taxas', lambda at: _rerun(_botao(at, 'Taxas').click())),
+        ('botão das', lambda at: _rerun(_botao(at, 'DAS').click())),
+        ('tabela detalhada', abrir_detalhe),
+        ('tabela: fechar', fechar_detalhe),
+        ('controles: marcar todos', lambda at: _rerun(_checkbox(at, 'Selecionar TODOS os Controles').check())),
+        ('produtos: marcar todos', lambda at: _rerun(_checkbox(at, 'Selecionar TODOS os Produtos').check())),
+    ]
+
+
+def executar_sessao(numero, rodadas, inicio, medicoes, lock):
+    from streamlit.testing.v1 import AppTest
+
+    rnd = random.Random(numero)
+    at = AppTest.from_file(SCRIPT, default_timeout=TIMEOUT_RERUN)
+    acoes = [
+        ('abrir página', lambda at: at.run()),
+        ('login', lambda at: _rerun(at.text_input(key='password_input').input(SENHA))),
+    ]
+    for _ in range(rodadas):
+        acoes += roteiro(rnd)
+
+    inicio.wait()
+    for nome, acao in acoes:
+        t0 = time.perf_counter()
+        erro = None
+        try:
+            acao(at)
+            if at.exception:
+                erro = at.exception[0].message
+        except Exception as e:
+            erro = f'{type(e).__name__}: {e}'
+        segundos = time.perf_counter() - t0
+        with lock:
+            medicoes.append({'sessao': numero, 'acao': nome, 'segundos': segundos, 'erro': erro})
+        if erro:
+            # Sessão em estado desconhecido: as próximas ações não seriam representativas
+            return
+
+
+class AmostradorMemoria:
+    def __init__(self, intervalo=0.1):
+        self.intervalo = intervalo
+        self.amostras = []
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._rodar, daemon=True)
+
+    def _rodar(self):
+        while not self._parar.is_set():
+            self.amostras.append(instrumentacao.memoria_rss_mb())
+            self._parar.wait(self.intervalo)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+        self.amostras.append(instrumentacao.memoria_rss_mb())
+
+
+def aquecer():
+    """Primeira carga (download + ETL) fora da medição; devolve os segundos gastos."""
+    from streamlit.testing.v1 import AppTest
+
+    t0 = time.perf_counter()
+    at = AppTest.from_file(SCRIPT, default_timeout=TIMEOUT_RERUN)
+    at.session_state['password_correct'] = True
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return time.perf_counter() - t0
+
+
+def rodar_cenario(sessoes, rodadas):
+    medicoes = []
+    lock = threading.Lock()
+    inicio = threading.Barrier(sessoes)
+    with AmostradorMemoria() as memoria, ThreadPoolExecutor(max_workers=sessoes) as pool:
+        t0 = time.perf_counter()
+        for futuro in [pool.submit(executar_sessao, n, rodadas, inicio, medicoes, lock) for n in range(sessoes)]:
+            futuro.result()
+        duracao = time.perf_counter() - t0
+    return resumir(sessoes, medicoes, duracao, memoria.amostras)
+
+
+# ==============================================================================
+# RELATÓRIO
+# ==============================================================================
+def percentis(tempos):
+    if not len(tempos):
+        return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+    p50, p95, p99 = np.percentile(tempos, [50, 95, 99])
+    return {'p50': p50, 'p95': p95, 'p99': p99, 'max': max(tempos)}
+
+
+def resumir(sessoes, medicoes, duracao, memoria):
+    ok = [m for m in medicoes if m['erro'] is None]
+    por_acao = {}
+    for m in ok:
+        por_acao.setdefault(m['acao'], []).append(m['segundos'])
+    return {
+        'sessoes': sessoes,
+        'reruns': len(ok),
+        'erros': [m for m in medicoes if m['erro'] is not None],
+        'duracao': duracao,
+        'throughput': len(ok) / duracao if duracao else 0.0,
+        'geral': percentis([m['segundos'] for m in ok]),
+        'por_acao': {acao: {'n': len(t), **percentis(t)} for acao, t in por_acao.items()},
+        'memoria_inicial_mb': memoria[0] if memoria else None,
+        'memoria_pico_mb': max(memoria) if memoria else None,
+        'memoria_final_mb': memoria[-1] if memoria else None,
+    }
+
+
+def _ms(valor):
+    return '-' if valor is None else f'{valor * 1000:.0f}'
+
+
+def formatar(resultado):
+    r = resultado
+    linhas = [
+        f"Sessões: {r['sessoes']}  reruns: {r['reruns']}  erros: {len(r['erros'])}  "
+        f"duração: {r['duracao']:.1f} s  throughput: {r['throughput']:.2f} reruns/s",
+        f"Memória do servidor (RSS): inicial {r['memoria_inicial_mb']:.0f} MB, "
+        f"pico {r['memoria_pico_mb']:.0f} MB, final {r['memoria_final_mb']:.0f} MB",
+        f"{'ação':<28} {'n':>5} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'máx (ms)':>9}",
+    ]
+    for acao, p in [('TODAS', {'n': r['reruns'], **r['geral']})] + list(r['por_acao'].items()):
+        linhas.append(f"{acao:<28} {p['n']:>5} {_ms(p['p50']):>9} {_ms(p['p95']):>9} {_ms(p['p99']):>9} {_ms(p['max']):>9}")
+    for erro in r['erros'][:5]:
+        linhas.append(f"⚠️ sessão {erro['sessao']}, {erro['acao']}: {erro['erro']}")
+    return '\n'.join(linhas)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Teste de carga do Dashboard com sessões concorrentes (AppTest).')
+    parser.add_argument('--sessoes', type=int, nargs='+', default=[20, 50])
+    parser.add_argument('--linhas', type=int, default=50_000, help='lançamentos da planilha sintética')
+    parser.add_argument('--rodadas', type=int, default=2, help='repetições do roteiro de ações por sessão')
+    parser.add_argument('--dir', default=os.path.join(tempfile.gettempdir(), 'ohana_carga'))
+    parser.add_argument('--saida', help='também grava o relatório neste arquivo')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.dir, exist_ok=True)
+    preparar_ambiente(args.linhas, args.dir)
+    blocos = [f"Planilha sintética: {args.linhas} linhas; primeira carga (ETL): {aquecer():.1f} s"]
+    for sessoes in args.sessoes:
+        print(f'Rodando {sessoes} sessões...', flush=True)
+        blocos.append(formatar(rodar_cenario(sessoes, args.rodadas)))
+
+    relatorio = '\n\n'.join(blocos)
+    print(relatorio)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            f.write(relatorio + '\n')
+
+
+if __name__ == '__main__':
+    main()
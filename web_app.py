@@ -5,17 +5,21 @@ import plotly.graph_objects as go
 import streamlit.components.v1 as components
 from streamlit_option_menu import option_menu
 import hmac
+import os
+from datetime import datetime
+
+import analise
+import etl
+import exportacao
+import fontes
+import publicacao
+from cache_derivados import CacheDerivados, chave_selecao
+import instrumentacao
+from normalizacao import extrair_id, gerar_sugestao, limpar_valor, normalizar_texto
 
 # ==============================================================================
 # 1. CONFIGURAÇÃO GERAL
 # ==============================================================================
-st.set_page_config(
-    page_title="Ohana Soluções Financeiras",
-    layout="wide",
-    initial_sidebar_state="expanded",
-    page_icon="📊"
-)
-
 LOGO_URL = "https://i.ibb.co/xZGzw7F/ohana.png"
 
 # --- CONSTANTES DE DATA ---
@@ -48,7 +52,7 @@ ICONS = {
 }
 
 # --- CSS ---
-st.markdown(f"""
+CSS = f"""
 <style>
     @import url('https://fonts.googleapis.com/css2?family=Noto+Sans:wght@300;400;600;700&display=swap');
     .stApp {{ background-color: {COR_FUNDO}; color: {COR_TEXTO}; }}
@@ -80,12 +84,17 @@ st.markdown(f"""
     div[data-testid="stDataFrame"] {{ background-color: {COR_CARD}; border-radius: 8px; }}
     div[data-testid="stAlert"] {{ padding: 0.5rem; border-radius: 8px; }}
 </style>
-""", unsafe_allow_html=True)
+"""
 
 # --- FORMATADOR BRL ---
 def format_currency(value):
     return f"R$ {value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
 
+def rotulo_mes(mes, curto=False):
+    if pd.isna(mes): return "Sem data"
+    nome = MESES_DICT[mes.month]
+    return f"{nome[:3]}/{mes.year % 100:02d}" if curto else f"{nome}/{mes.year}"
+
 def kpi_html(titulo, valor, sub, svg_icon):
     return f"""
     <div class="kpi-card">
@@ -98,6 +107,38 @@ def kpi_html(titulo, valor, sub, svg_icon):
     </div>
     """
 
+def status_dados_html(atualizador):
+    idade = atualizador.idade()
+    if idade is None:
+        texto = "Dados ainda não carregados"
+    else:
+        hora = datetime.fromtimestamp(atualizador.atualizado_em).strftime('%d/%m %H:%M')
+        texto = f"Dados de {hora} (há {int(idade // 60)} min)"
+
+    if atualizador.atualizando:
+        status, cor = "🔄 Atualizando em segundo plano...", COR_SECUNDARIA
+    elif atualizador.ultimo_erro:
+        status, cor = "⚠️ Falha na última atualização", COR_WARN
+    else:
+        status, cor = "✅ Atualizado", COR_SUBTEXTO
+    return f"""<div style="text-align: center; font-size: 11px; color: {COR_SUBTEXTO};">🕒 {texto}<br><span style="color: {cor};">{status}</span></div>"""
+
+def render_diagnostico(logs, rastreios, conciliacao=None, cache=None, downloads=None):
+    for log in logs: st.text(log)
+    if downloads:
+        st.markdown("**📥 Buscas na fonte de dados (mais recente primeiro)**")
+        st.dataframe(pd.DataFrame(downloads[::-1]), use_container_width=True, hide_index=True)
+    if cache is not None:
+        st.markdown("**🗃️ Cache compartilhado (filtros, KPIs e gráficos)**")
+        st.dataframe(pd.DataFrame([cache]), use_container_width=True, hide_index=True)
+    if conciliacao is not None and not conciliacao.empty:
+        st.markdown("**🔗 Conciliação de Nº Controle (despesas sem receita exata)**")
+        st.dataframe(conciliacao, use_container_width=True, hide_index=True)
+    for rastreio in rastreios:
+        if rastreio is None or not rastreio.etapas: continue
+        st.markdown(f"**⏱️ {rastreio.nome.capitalize()}** — {rastreio.total():.3f} s")
+        st.dataframe(pd.DataFrame(rastreio.etapas).drop(columns='rastreio'), use_container_width=True, hide_index=True)
+
 # ==============================================================================
 # 2. LOGIN
 # ==============================================================================
@@ -130,334 +171,454 @@ def check_auth():
         st.markdown("</div>", unsafe_allow_html=True)
     return False
 
-if not check_auth(): st.stop()
 
 # ==============================================================================
 # 3. ETL (FILTRAGEM DE LIXO E MAPA DE DADOS)
 # ==============================================================================
-@st.cache_data(ttl=600)
+@st.cache_resource
+def get_ingestao():
+    # Compartilhada entre sessões e reruns: guarda o df_temp de cada aba já processada
+    return etl.IngestaoIncremental()
+
+@st.cache_resource
+def get_fonte():
+    # Export HTTP da planilha ou diretório local (OHANA_FONTE_DIR); guarda ETag/hash entre cargas
+    return fontes.criar_fonte()
+
+def carregar_da_fonte():
+    fonte = get_fonte()
+    with instrumentacao.rastrear("carga"):
+        with instrumentacao.etapa("download", fonte=fonte.descricao) as reg:
+            conteudo, info = fonte.buscar()
+            reg['bytes'] = info['bytes']
+            reg['status'] = info['status']
+        if conteudo is None:
+            # Nada mudou na fonte: o dataset atual continua valendo, sem parse
+            return None
+        ingestao = get_ingestao()
+        df_final, logs = ingestao.carregar(conteudo)
+
+        try:
+            with instrumentacao.etapa("snapshot"):
+                etl.salvar_snapshot(df_final, logs, versao=ingestao.versao)
+        except OSError as e:
+            logs = logs + [f"⚠️ Snapshot em disco não atualizado: {str(e)}"]
+    fonte.confirmar()
+    return df_final, logs, ingestao.versao
+
+@st.cache_resource
+def get_leitor_publicacao():
+    return publicacao.LeitorPublicacao(publicacao.DIRETORIO)
+
+def carregar_publicado():
+    with instrumentacao.rastrear("carga"):
+        return get_leitor_publicacao().carregar()
+
+def get_relatorio_conciliacao():
+    if publicacao.DIRETORIO:
+        return get_leitor_publicacao().relatorio
+    return get_ingestao().conciliador.relatorio
+
+@st.cache_resource
+def get_atualizador():
+    if publicacao.DIRETORIO:
+        # O ETL roda no worker (publicacao.py); aqui só se acompanha a versão mais nova publicada
+        return etl.AtualizadorDados(carregar_publicado, ttl=publicacao.INTERVALO_VERIFICACAO)
+    # Parte do snapshot em disco (se houver) e mantém os dados atualizados em segundo plano
+    snapshot = etl.ler_snapshot()
+    atualizado_em = os.path.getmtime(etl.SNAPSHOT_PATH) if snapshot is not None else None
+    return etl.AtualizadorDados(carregar_da_fonte, ttl=600, inicial=snapshot, atualizado_em=atualizado_em)
+
 def load_data():
-    SHEET_ID = '19QVv-DBUIHoFx1mn5nL1NZUcHyPnzGLZfgCb9UH0ARo'
-    url = f'https://docs.google.com/spreadsheets/d/{SHEET_ID}/export?format=xlsx'
-    
-    logs = []
-    
-    try:
-        all_sheets = pd.read_excel(url, sheet_name=None, engine='openpyxl')
-        df_list = []
-        
-        def limpar_valor(series):
-            if series.dtype == 'O': 
-                return pd.to_numeric(
-                    series.astype(str).str.replace('R$', '', regex=False)
-                          .str.replace('.', '', regex=False)
-                          .str.replace(',', '.', regex=False),
-                    errors='coerce'
-                ).fillna(0)
-            return series.fillna(0)
-
-        for sheet_name, df in all_sheets.items():
-            s_name_upper = sheet_name.upper()
-            df.columns = df.columns.astype(str).str.strip().str.upper()
-            
-            tipo_lancamento = None
-            if 'RECEB' in s_name_upper or 'RECEIT' in s_name_upper:
-                tipo_lancamento = 'RECEITA'
-            elif 'PAGA' in s_name_upper or 'DESP' in s_name_upper or 'SAIDA' in s_name_upper:
-                tipo_lancamento = 'DESPESA'
-            
-            if tipo_lancamento:
-                col_valor = next((c for c in df.columns if c == 'VALOR'), None) or \
-                            next((c for c in df.columns if 'VALOR' in c), None)
-
-                col_curso = next((c for c in df.columns if "CONTROLE" in c and "PADRONIZADO" in c), None)
-                if not col_curso:
-                    col_curso = next((c for c in df.columns if "CONTROLE" in c), None) or \
-                                next((c for c in df.columns if "CURSO" in c), None)
-
-                col_produto = next((c for c in df.columns if "PRODUTO" in c or "SERVIÇO" in c), None)
-                
-                col_entidade = next((c for c in df.columns if "CLIENTE" in c or "FORNECEDOR" in c or "FAVORECIDO" in c), None)
-                if not col_entidade:
-                    col_entidade = next((c for c in df.columns if "NOME" in c or "DESCRI" in c), None)
-
-                col_data = next((c for c in df.columns if 'PAGAMENTO' in c and 'DATA' in c), None) or \
-                           next((c for c in df.columns if 'DATA' in c), None)
-                
-                if col_valor and col_curso:
-                    df_subset = df.copy()
-                    
-                    df_subset['TEMP_CURSO'] = (
-                        df_subset[col_curso]
-                        .fillna('')
-                        .astype(str)
-                        .str.strip()
-                        .str.upper()
-                        .str.replace(r'\.0$', '', regex=True)
-                    )
-                    
-                    if col_produto:
-                        df_subset['TEMP_PRODUTO'] = df_subset[col_produto].fillna('').astype(str).str.strip().str.upper()
-                    else:
-                        df_subset['TEMP_PRODUTO'] = 'NÃO INFORMADO'
-                        
-                    if col_entidade:
-                        df_subset['TEMP_ENTIDADE'] = df_subset[col_entidade].fillna('').astype(str).str.strip().str.upper()
-                    else:
-                        df_subset['TEMP_ENTIDADE'] = 'NÃO INFORMADO'
-
-                    # LISTA DE EXCLUSÃO (CRÍTICO)
-                    valores_invalidos = [
-                        '', 'NAN', 'NAT', 'NONE', 'NULL', '0', 'N/A', '-', 'nan',
-                        'NÃO ENCONTRADO', 'NAO ENCONTRADO', 'NAO_ENCONTRADO'
-                    ]
-                    
-                    mask_invalid = df_subset['TEMP_CURSO'].isin(valores_invalidos)
-                    df_subset = df_subset[~mask_invalid]
-                    
-                    if df_subset.empty:
-                        logs.append(f"⚠️ Aba '{sheet_name}' ignorada: Registros sem 'Nº Controle' válido.")
-                        continue
-
-                    df_temp = pd.DataFrame()
-                    df_temp['CURSO'] = df_subset['TEMP_CURSO']
-                    df_temp['PRODUTO'] = df_subset['TEMP_PRODUTO']
-                    df_temp['ENTIDADE'] = df_subset['TEMP_ENTIDADE']
-                    df_temp['VALOR'] = limpar_valor(df_subset[col_valor]).abs() 
-                    
-                    if col_data:
-                        df_temp['DATA'] = pd.to_datetime(df_subset[col_data], errors='coerce')
-                    else:
-                        df_temp['DATA'] = pd.NaT
-                        
-                    df_temp['TIPO'] = tipo_lancamento
-                    df_list.append(df_temp)
-            
-        df_final = pd.concat(df_list, ignore_index=True) if df_list else pd.DataFrame()
-        
-        if not df_final.empty:
-            mapa_produtos = (
-                df_final[df_final['TIPO'] == 'RECEITA']
-                .drop_duplicates('CURSO')
-                .set_index('CURSO')['PRODUTO']
-                .to_dict()
-            )
-            mask_update = (df_final['TIPO'] == 'DESPESA')
-            df_final.loc[mask_update, 'PRODUTO'] = df_final.loc[mask_update, 'CURSO'].map(mapa_produtos).fillna('OUTROS / INDEFINIDO')
+    df, logs, versao = get_atualizador().obter()
+    # Dados novos descartam de uma vez os resultados derivados da versão anterior
+    get_cache_derivados().definir_versao(versao)
+    return df, logs, versao
 
-        return df_final, logs
+@st.cache_resource
+def get_cache_derivados():
+    # Filtros, listas, KPIs e frames dos gráficos compartilhados entre sessões (LRU)
+    return CacheDerivados()
 
-    except Exception as e:
-        return pd.DataFrame(), [f"Erro Crítico: {str(e)}"]
+def derivado(versao, chave, calcular):
+    return get_cache_derivados().obter(versao, chave, calcular)
+
+@st.cache_resource(max_entries=2)
+def get_cubo(versao, _df):
+    # Montado uma vez por carga de dados (chave = versão); compartilhado e somente leitura.
+    # Com o dataset publicado pelo worker, o cubo já vem pronto do diretório compartilhado.
+    cubo = publicacao.ler_agregado(publicacao.DIRETORIO, versao, 'cubo') if publicacao.DIRETORIO and versao else None
+    return etl.montar_cubo(_df) if cubo is None else cubo
+
+@st.cache_resource(max_entries=2)
+def get_serie_mensal(versao, _df):
+    # Somas mensais acumuladas: KPIs e tendência de qualquer período sem reagregar
+    return etl.SerieMensal(get_cubo(versao, _df))
+
+@st.cache_resource(max_entries=2)
+def get_indice_datas(versao, _df):
+    # Ordenação por DATA feita uma vez por carga (período da tabela detalhada)
+    return etl.IndiceDatas(_df)
+
+@st.cache_resource(max_entries=12)
+def get_ordem_detalhe(versao, ordenacao, _df):
+    return analise.ordem_detalhe(_df, ordenacao)
 
-df, debug_logs = load_data()
 
 # ==============================================================================
 # 4. SIDEBAR
 # ==============================================================================
-with st.sidebar:
-    st.image(LOGO_URL, use_container_width=True, output_format="PNG")
-    st.markdown(f"""<div style="text-align: center; margin-bottom: 20px; margin-top: -10px;"><p style="color: {COR_SUBTEXTO}; font-size: 12px; letter-spacing: 1px;">Intelligence Dashboard</p></div>""", unsafe_allow_html=True)
+def render_sidebar():
+    with st.sidebar:
+        st.image(LOGO_URL, use_container_width=True, output_format="PNG")
+        st.markdown(f"""<div style="text-align: center; margin-bottom: 20px; margin-top: -10px;"><p style="color: {COR_SUBTEXTO}; font-size: 12px; letter-spacing: 1px;">Intelligence Dashboard</p></div>""", unsafe_allow_html=True)
     
-    selected = option_menu(
-        menu_title=None,
-        options=["Dashboard", "Power BI Relatório"],
-        icons=["rocket-takeoff", "graph-up"],
-        menu_icon="cast",
-        default_index=0,
-        styles={
-            "container": {"padding": "0!important", "background-color": "transparent"},
-            "icon": {"color": COR_PRIMARIA, "font-size": "16px"},
-            "nav-link": {"color": COR_SUBTEXTO, "font-size": "14px", "text-align": "left", "margin": "5px"},
-            "nav-link-selected": {"background-color": "rgba(235, 82, 131, 0.15)", "color": COR_PRIMARIA, "border-left": f"4px solid {COR_PRIMARIA}"},
-        }
-    )
-    st.markdown("---")
-    if st.button("🔒 Sair / Logout", use_container_width=True):
-        st.session_state["password_correct"] = False
-        st.rerun()
-
-if df.empty:
-    st.error("Nenhum dado financeiro válido foi encontrado.")
-    with st.expander("🕵️ Ver Diagnóstico", expanded=True):
-        for log in debug_logs: st.text(log)
-    st.stop()
+        selected = option_menu(
+            menu_title=None,
+            options=["Dashboard", "Power BI Relatório"],
+            icons=["rocket-takeoff", "graph-up"],
+            menu_icon="cast",
+            default_index=0,
+            styles={
+                "container": {"padding": "0!important", "background-color": "transparent"},
+                "icon": {"color": COR_PRIMARIA, "font-size": "16px"},
+                "nav-link": {"color": COR_SUBTEXTO, "font-size": "14px", "text-align": "left", "margin": "5px"},
+                "nav-link-selected": {"background-color": "rgba(235, 82, 131, 0.15)", "color": COR_PRIMARIA, "border-left": f"4px solid {COR_PRIMARIA}"},
+            }
+        )
+        st.markdown("---")
+        atualizador = get_atualizador()
+        st.markdown(status_dados_html(atualizador), unsafe_allow_html=True)
+        if atualizador.ultimo_erro:
+            st.caption(f"Mantendo os últimos dados válidos. Erro: {atualizador.ultimo_erro}")
+        st.markdown("---")
+        if st.button("🔒 Sair / Logout", use_container_width=True):
+            st.session_state["password_correct"] = False
+            st.rerun()
+    return selected
 
 # ==============================================================================
 # 5. DASHBOARD
 # ==============================================================================
-if selected == "Dashboard":
-    st.markdown(f"""<div style="display: flex; align-items: center; gap: 10px; margin-bottom: 20px;">{ICONS['rocket']}<h1 style="margin: 0; font-size: 28px; font-weight: 700;">Visão Executiva</h1></div>""", unsafe_allow_html=True)
-
-    # --- INICIALIZAÇÃO DE ESTADO ---
-    if 'show_taxas' not in st.session_state: st.session_state.show_taxas = False
-    if 'show_das' not in st.session_state: st.session_state.show_das = False
-
-    def toggle_taxas(): st.session_state.show_taxas = not st.session_state.show_taxas
-    def toggle_das(): st.session_state.show_das = not st.session_state.show_das
-
-    # --- FILTROS ---
-    with st.expander("🔍 Filtros: Produto & Controle", expanded=True):
-        c_f1, c_f2 = st.columns(2)
-        
-        produtos_unicos = sorted([p for p in df['PRODUTO'].unique() if p and str(p) != 'nan'])
-        ver_todos_prod = c_f1.checkbox("Selecionar TODOS os Produtos", value=True)
-        
-        if ver_todos_prod:
-            c_f1.info("✅ Todos os Produtos Selecionados")
-            df_step1 = df
-        else:
-            sel_produto = c_f1.multiselect("Selecione Produtos", produtos_unicos)
-            if not sel_produto:
-                c_f1.warning("⚠️ Selecione pelo menos um produto")
-                df_step1 = df[df['PRODUTO'].isin([])]
-            else:
-                df_step1 = df[df['PRODUTO'].isin(sel_produto)]
-        
-        controles_unicos = sorted(df_step1['CURSO'].unique())
-        ver_todos_controle = c_f2.checkbox("Selecionar TODOS os Controles", value=True)
-        
-        if ver_todos_controle:
-            c_f2.info("✅ Todos os Controles Selecionados")
-            df_final = df_step1
-        else:
-            sel_controle = c_f2.multiselect("Selecione Nº Controle", controles_unicos)
-            if not sel_controle:
-                c_f2.warning("⚠️ Selecione pelo menos um controle")
-                df_final = df_step1[df_step1['CURSO'].isin([])]
+# Cada bloco é um st.fragment: clicar em Taxas/DAS ou paginar a tabela reroda só
+# o próprio bloco. A seleção de filtros fica em st.session_state.selecao e os
+# blocos buscam cubos, KPIs e figuras no cache compartilhado (chave = versão +
+# seleção), então um rerun parcial não recalcula nada que já exista.
+def toggle_taxas(): st.session_state.show_taxas = not st.session_state.show_taxas
+def toggle_das(): st.session_state.show_das = not st.session_state.show_das
+
+def chave_dashboard(selecao):
+    return (selecao['periodo'], chave_selecao(selecao['produtos']), chave_selecao(selecao['controles']))
+
+def cubo_do_periodo(versao, serie, periodo):
+    inicio, fim, sem_data = periodo
+    return derivado(versao, ('cubo', periodo), lambda: analise.cubo_periodo(serie, inicio, fim, sem_data))
+
+def cubo_dos_produtos(versao, serie, periodo, produtos):
+    return derivado(versao, ('cubo_produtos', periodo, chave_selecao(produtos)),
+                    lambda: analise.filtrar_cubo(cubo_do_periodo(versao, serie, periodo), produtos=produtos))
+
+def cubo_da_selecao(versao, serie, selecao):
+    return derivado(versao, ('cubo_final', chave_dashboard(selecao)),
+                    lambda: analise.filtrar_cubo(cubo_dos_produtos(versao, serie, selecao['periodo'], selecao['produtos']), controles=selecao['controles']))
+
+def kpis_da_selecao(versao, serie, selecao):
+    return derivado(versao, ('kpis', chave_dashboard(selecao)), lambda: analise.calcular_kpis(cubo_da_selecao(versao, serie, selecao)))
+
+# --- FIGURAS (MONTADAS UMA VEZ POR VERSÃO + SELEÇÃO) ---
+def figura_performance(df_chart):
+    df_perf = df_chart.assign(VOLUME=df_chart['RECEITA'] + df_chart['DESPESA']).sort_values('VOLUME', ascending=False).head(10)
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x=df_perf['CURSO'], y=df_perf['RECEITA'], name='Receita', marker_color=COR_SECUNDARIA,
+        text=df_perf['RECEITA'].apply(lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")),
+        textposition='auto'
+    ))
+    fig.add_trace(go.Bar(
+        x=df_perf['CURSO'], y=df_perf['DESPESA'], name='Despesa', marker_color=COR_PRIMARIA,
+        text=df_perf['DESPESA'].apply(lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")),
+        textposition='auto'
+    ))
+    fig.update_layout(
+        barmode='group', height=400, 
+        paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
+        font=dict(color=COR_SUBTEXTO),
+        xaxis=dict(showgrid=False, type='category'), 
+        yaxis=dict(showgrid=True, gridcolor='rgba(255,255,255,0.05)'),
+        legend=dict(orientation="h", y=1.1, x=0), separators=",."
+    )
+    return fig
+
+def figura_ranking(df_chart):
+    df_rank = df_chart.sort_values('RECEITA', ascending=True).tail(10)
+    df_rank['TEXTO_BRL'] = df_rank['RECEITA'].apply(lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
+
+    fig_rank = px.bar(df_rank, y='CURSO', x='RECEITA', orientation='h', text='TEXTO_BRL')
+    fig_rank.update_traces(marker_color=COR_SECUNDARIA)
+    fig_rank.update_layout(
+        height=400, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
+        font=dict(color=COR_SUBTEXTO), yaxis_title="Nº Controle", xaxis_title=None,
+        xaxis=dict(showgrid=False), yaxis=dict(type='category', title=None), separators=",."
+    )
+    return fig_rank
+
+def figura_tendencia(df_tend):
+    rotulos = [rotulo_mes(m, curto=True) for m in df_tend['MES']]
+
+    fig_tend = go.Figure()
+    fig_tend.add_trace(go.Scatter(
+        x=rotulos, y=df_tend['RECEITA'], name='Receita', mode='lines+markers', line=dict(color=COR_SECUNDARIA, width=3),
+        hovertext=df_tend['RECEITA'].apply(format_currency), hoverinfo='text+name'
+    ))
+    fig_tend.add_trace(go.Scatter(
+        x=rotulos, y=df_tend['DESPESA'], name='Despesa', mode='lines+markers', line=dict(color=COR_PRIMARIA, width=3),
+        hovertext=df_tend['DESPESA'].apply(format_currency), hoverinfo='text+name'
+    ))
+    fig_tend.update_layout(
+        height=350,
+        paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
+        font=dict(color=COR_SUBTEXTO),
+        xaxis=dict(showgrid=False, type='category'),
+        yaxis=dict(showgrid=True, gridcolor='rgba(255,255,255,0.05)'),
+        legend=dict(orientation="h", y=1.1, x=0), separators=",."
+    )
+    return fig_tend
+
+def exportar_sob_demanda(gerar_lotes, formato, moeda, nome_aba):
+    # Vai como data= do download_button: só roda quando alguém clica
+    def gerar():
+        with exportacao.exportar(gerar_lotes(), formato, moeda, nome_aba) as arquivo:
+            return arquivo.read()
+    return gerar
+
+# --- FRAGMENTOS ---
+@st.fragment
+def render_filtros(df, versao):
+    with instrumentacao.etapa("filtros"):
+        serie = get_serie_mensal(versao, df)
+
+        with st.expander("🔍 Filtros: Período, Produto & Controle", expanded=True):
+            c_p1, c_p2 = st.columns([3, 1])
+            meses = list(serie.meses)
+            if len(meses) > 1:
+                inicio, fim = c_p1.select_slider("Período", options=meses, value=(meses[0], meses[-1]), format_func=rotulo_mes)
             else:
-                df_final = df_step1[df_step1['CURSO'].isin(sel_controle)]
-
-    st.markdown("<br>", unsafe_allow_html=True)
-
-    # --- CÁLCULOS KPI ---
-    cursos_validos_receita = df[df['TIPO'] == 'RECEITA']['CURSO'].unique()
+                inicio = fim = meses[0] if meses else None
+                if meses: c_p1.info(f"📅 Período: {rotulo_mes(meses[0])}")
+            qtd_sem_data = int(serie.sem_data_linhas.sum())
+            sem_data = c_p2.checkbox(f"Incluir lançamentos sem data ({qtd_sem_data})", value=True) if qtd_sem_data else False
+            periodo = (inicio, fim, sem_data)
+            cubo = cubo_do_periodo(versao, serie, periodo)
+
+            c_f1, c_f2 = st.columns(2)
     
-    receita = df_final[df_final['TIPO'] == 'RECEITA']['VALOR'].sum()
+            produtos_unicos = derivado(versao, ('produtos', periodo), lambda: [p for p in etl.valores_presentes(cubo['PRODUTO']) if p and str(p) != 'nan'])
+            ver_todos_prod = c_f1.checkbox("Selecionar TODOS os Produtos", value=True)
     
-    df_despesas_validas = df_final[
-        (df_final['TIPO'] == 'DESPESA') & 
-        (df_final['CURSO'].isin(cursos_validos_receita))
-    ]
-    despesa = df_despesas_validas['VALOR'].sum()
-    
-    lucro = receita - despesa # Margem Bruta
+            if ver_todos_prod:
+                c_f1.info("✅ Todos os Produtos Selecionados")
+                sel_produto = None
+            else:
+                sel_produto = c_f1.multiselect("Selecione Produtos", produtos_unicos)
+                if not sel_produto:
+                    c_f1.warning("⚠️ Selecione pelo menos um produto")
+            cubo_step1 = cubo_dos_produtos(versao, serie, periodo, sel_produto)
     
-    val_taxas_total = receita * 0.0233
-    val_das_total = receita * 0.0989
-    margem_contribuicao = lucro - val_taxas_total - val_das_total
+            controles_unicos = derivado(versao, ('controles', periodo, chave_selecao(sel_produto)), lambda: etl.valores_presentes(cubo_step1['CURSO']))
+            ver_todos_controle = c_f2.checkbox("Selecionar TODOS os Controles", value=True)
     
-    margem = (margem_contribuicao / receita * 100) if receita > 0 else 0
+            if ver_todos_controle:
+                c_f2.info("✅ Todos os Controles Selecionados")
+                sel_controle = None
+            else:
+                sel_controle = c_f2.multiselect("Selecione Nº Controle", controles_unicos)
+                if not sel_controle:
+                    c_f2.warning("⚠️ Selecione pelo menos um controle")
 
-    # --- EXIBIÇÃO DE KPIS ---
-    k1, k2, k3, k4, k5 = st.columns(5)
-    with k1: st.markdown(kpi_html("Receita de Vendas", format_currency(receita), "Entradas (Vinc.)", ICONS['money']), unsafe_allow_html=True)
-    with k2: st.markdown(kpi_html("Despesas de Vendas", format_currency(despesa), "Saídas (Validadas)", ICONS['down']), unsafe_allow_html=True)
-    with k3: st.markdown(kpi_html("Margem Bruta", format_currency(lucro), "Resultado", ICONS['profit']), unsafe_allow_html=True)
-    with k4: st.markdown(kpi_html("Margem Contribuição", format_currency(margem_contribuicao), "Margem bruta - Taxas - DAS", ICONS['bank']), unsafe_allow_html=True)
-    with k5: st.markdown(kpi_html("Margem %", f"{margem:.1f}%", "ROI Líquido", ICONS['chart']), unsafe_allow_html=True)
+        st.markdown("<br>", unsafe_allow_html=True)
 
-    st.markdown("<br>", unsafe_allow_html=True)
+    # Os outros blocos dependem da seleção: se ela mudou, reroda a página inteira
+    selecao = {'periodo': periodo, 'produtos': sel_produto, 'controles': sel_controle}
+    anterior = st.session_state.get('selecao')
+    st.session_state.selecao = selecao
+    if anterior is not None and chave_dashboard(anterior) != chave_dashboard(selecao):
+        st.rerun()
+
+@st.fragment
+def render_kpis(df, versao):
+    # --- CÁLCULOS KPI (SOBRE O CUBO, JÁ COM A REGRA DE DESPESA VALIDADA) ---
+    with instrumentacao.etapa("kpis"):
+        kpis = kpis_da_selecao(versao, get_serie_mensal(versao, df), st.session_state.selecao)
+        receita = kpis['receita']
+        despesa = kpis['despesa']
+        lucro = kpis['lucro'] # Margem Bruta
+        margem_contribuicao = kpis['margem_contribuicao']
+        margem = kpis['margem']
+
+        # --- EXIBIÇÃO DE KPIS ---
+        k1, k2, k3, k4, k5 = st.columns(5)
+        with k1: st.markdown(kpi_html("Receita de Vendas", format_currency(receita), "Entradas (Vinc.)", ICONS['money']), unsafe_allow_html=True)
+        with k2: st.markdown(kpi_html("Despesas de Vendas", format_currency(despesa), "Saídas (Validadas)", ICONS['down']), unsafe_allow_html=True)
+        with k3: st.markdown(kpi_html("Margem Bruta", format_currency(lucro), "Resultado", ICONS['profit']), unsafe_allow_html=True)
+        with k4: st.markdown(kpi_html("Margem Contribuição", format_currency(margem_contribuicao), "Margem bruta - Taxas - DAS", ICONS['bank']), unsafe_allow_html=True)
+        with k5: st.markdown(kpi_html("Margem %", f"{margem:.1f}%", "ROI Líquido", ICONS['chart']), unsafe_allow_html=True)
 
-    # --- BOTÕES E KPIS DINÂMICOS ---
-    btn_col1, btn_col2, _ = st.columns([1, 1, 2])
-    
-    label_taxas = "🔽 Ocultar Taxas" if st.session_state.show_taxas else "▶ Taxas bancárias (média)"
-    label_das = "🔽 Ocultar DAS" if st.session_state.show_das else "▶ DAS Real"
-    
-    btn_col1.button(label_taxas, on_click=toggle_taxas, use_container_width=True)
-    btn_col2.button(label_das, on_click=toggle_das, use_container_width=True)
-    
-    if st.session_state.show_taxas or st.session_state.show_das:
-        ext_kpi_cols = st.columns(4)
-        idx = 0
-        
-        if st.session_state.show_taxas:
-            with ext_kpi_cols[idx]:
-                st.markdown(kpi_html("Taxas bancárias (média)", format_currency(val_taxas_total), "2,33% da Receita", ICONS['bank']), unsafe_allow_html=True)
-            idx += 1
-            
-        if st.session_state.show_das:
-            with ext_kpi_cols[idx]:
-                st.markdown(kpi_html("DAS Real", format_currency(val_das_total), "9,89% da Receita", ICONS['tax']), unsafe_allow_html=True)
-        
         st.markdown("<br>", unsafe_allow_html=True)
 
-    # --- GRÁFICOS ---
-    df_g_receita = df_final[df_final['TIPO'] == 'RECEITA']
-    df_g_despesa = df_despesas_validas
-    df_grafico = pd.concat([df_g_receita, df_g_despesa])
-    
-    df_chart = df_grafico.groupby(['CURSO', 'TIPO'])['VALOR'].sum().unstack(fill_value=0).reset_index()
-    if 'RECEITA' not in df_chart.columns: df_chart['RECEITA'] = 0
-    if 'DESPESA' not in df_chart.columns: df_chart['DESPESA'] = 0
+@st.fragment
+def render_kpis_extras(df, versao):
+    # --- BOTÕES E KPIS DINÂMICOS (O CLIQUE REDESENHA SÓ ESTE BLOCO) ---
+    with instrumentacao.etapa("kpis extras"):
+        kpis = kpis_da_selecao(versao, get_serie_mensal(versao, df), st.session_state.selecao)
+        btn_col1, btn_col2, _ = st.columns([1, 1, 2])
+
+        label_taxas = "🔽 Ocultar Taxas" if st.session_state.show_taxas else "▶ Taxas bancárias (média)"
+        label_das = "🔽 Ocultar DAS" if st.session_state.show_das else "▶ DAS Real"
 
-    g1, g2 = st.columns([2, 1])
+        btn_col1.button(label_taxas, on_click=toggle_taxas, use_container_width=True)
+        btn_col2.button(label_das, on_click=toggle_das, use_container_width=True)
+
+        if st.session_state.show_taxas or st.session_state.show_das:
+            ext_kpi_cols = st.columns(4)
+            idx = 0
     
-    with g1:
-        st.markdown('<h3 style="color:white; font-size:18px;">Performance Financeira (Nº Controle)</h3>', unsafe_allow_html=True)
-        if not df_chart.empty:
-            df_chart['VOLUME'] = df_chart['RECEITA'] + df_chart['DESPESA']
-            df_perf = df_chart.sort_values('VOLUME', ascending=False).head(10)
-            
-            fig = go.Figure()
-            fig.add_trace(go.Bar(
-                x=df_perf['CURSO'], y=df_perf['RECEITA'], name='Receita', marker_color=COR_SECUNDARIA,
-                text=df_perf['RECEITA'].apply(lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")),
-                textposition='auto'
-            ))
-            fig.add_trace(go.Bar(
-                x=df_perf['CURSO'], y=df_perf['DESPESA'], name='Despesa', marker_color=COR_PRIMARIA,
-                text=df_perf['DESPESA'].apply(lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")),
-                textposition='auto'
-            ))
-            fig.update_layout(
-                barmode='group', height=400, 
-                paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
-                font=dict(color=COR_SUBTEXTO),
-                xaxis=dict(showgrid=False, type='category'), 
-                yaxis=dict(showgrid=True, gridcolor='rgba(255,255,255,0.05)'),
-                legend=dict(orientation="h", y=1.1, x=0), separators=",."
-            )
-            st.plotly_chart(fig, use_container_width=True)
-
-    with g2:
-        st.markdown('<h3 style="color:white; font-size:18px;">Top Ranking (Nº Controle)</h3>', unsafe_allow_html=True)
-        if not df_chart.empty:
-            df_rank = df_chart.sort_values('RECEITA', ascending=True).tail(10)
-            df_rank['TEXTO_BRL'] = df_rank['RECEITA'].apply(lambda x: f"R$ {x:,.2f}".replace(",", "X").replace(".", ",").replace("X", "."))
-            
-            fig_rank = px.bar(df_rank, y='CURSO', x='RECEITA', orientation='h', text='TEXTO_BRL')
-            fig_rank.update_traces(marker_color=COR_SECUNDARIA)
-            fig_rank.update_layout(
-                height=400, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
-                font=dict(color=COR_SUBTEXTO), yaxis_title="Nº Controle", xaxis_title=None,
-                xaxis=dict(showgrid=False), yaxis=dict(type='category', title=None), separators=",."
-            )
-            st.plotly_chart(fig_rank, use_container_width=True)
-
-    with st.expander("Visualizar Dados Detalhados"):
-        st.dataframe(
-            df_final[['DATA', 'CURSO', 'TIPO', 'VALOR', 'ENTIDADE', 'PRODUTO']]
-            .sort_values(['DATA', 'TIPO'], ascending=[False, True])
-            .rename(columns={
-                'DATA': 'Data',
-                'CURSO': 'Nº Controle',
-                'TIPO': 'Tipo',
-                'VALOR': 'Valor',
-                'ENTIDADE': 'Cliente/Fornecedor',
-                'PRODUTO': 'Conta/Serviço'
-            })
-            .style.format({'Valor': format_currency}),
-            use_container_width=True, height=300
-        )
+            if st.session_state.show_taxas:
+                with ext_kpi_cols[idx]:
+                    st.markdown(kpi_html("Taxas bancárias (média)", format_currency(kpis['taxas']), "2,33% da Receita", ICONS['bank']), unsafe_allow_html=True)
+                idx += 1
+        
+            if st.session_state.show_das:
+                with ext_kpi_cols[idx]:
+                    st.markdown(kpi_html("DAS Real", format_currency(kpis['das']), "9,89% da Receita", ICONS['tax']), unsafe_allow_html=True)
+    
+            st.markdown("<br>", unsafe_allow_html=True)
+
+@st.fragment
+def render_graficos(df, versao):
+    with instrumentacao.etapa("gráficos"):
+        serie = get_serie_mensal(versao, df)
+        selecao = st.session_state.selecao
+        chave = chave_dashboard(selecao)
+        df_chart = derivado(versao, ('df_chart', chave), lambda: analise.montar_df_chart(cubo_da_selecao(versao, serie, selecao)))
+
+        g1, g2 = st.columns([2, 1])
+
+        with g1:
+            st.markdown('<h3 style="color:white; font-size:18px;">Performance Financeira (Nº Controle)</h3>', unsafe_allow_html=True)
+            if not df_chart.empty:
+                st.plotly_chart(derivado(versao, ('fig_performance', chave), lambda: figura_performance(df_chart)), use_container_width=True)
+
+        with g2:
+            st.markdown('<h3 style="color:white; font-size:18px;">Top Ranking (Nº Controle)</h3>', unsafe_allow_html=True)
+            if not df_chart.empty:
+                st.plotly_chart(derivado(versao, ('fig_ranking', chave), lambda: figura_ranking(df_chart)), use_container_width=True)
+
+        inicio, fim, sem_data = selecao['periodo']
+        df_tend = derivado(versao, ('tendencia', chave), lambda: analise.tendencia_mensal(serie, inicio, fim, sem_data, selecao['produtos'], selecao['controles']))
+        if not df_tend.empty:
+            st.markdown('<h3 style="color:white; font-size:18px;">Evolução Mensal (Receita x Despesa)</h3>', unsafe_allow_html=True)
+            st.plotly_chart(derivado(versao, ('fig_tendencia', chave), lambda: figura_tendencia(df_tend)), use_container_width=True)
+
+@st.fragment
+def render_detalhe(df, versao):
+    # --- TABELA DETALHADA ---
+    with instrumentacao.etapa("tabela detalhada"):
+        # Só roda com o expander aberto: ordem pré-calculada e formatação apenas da página visível
+        detalhe = st.expander("Visualizar Dados Detalhados", key="detalhe_aberto", on_change="rerun")
+        if detalhe.open:
+            with detalhe:
+                selecao = st.session_state.selecao
+                c_t1, c_t2, c_t3 = st.columns([2, 1, 1])
+                ordenacao = c_t1.selectbox("Ordenar por", list(analise.ORDENACOES))
+                tamanho = c_t2.selectbox("Linhas por página", [50, 100, 250, 500])
+
+                mask = analise.mascara_linhas(df, produtos=selecao['produtos'], controles=selecao['controles'])
+                mask &= get_indice_datas(versao, df).mascara(*selecao['periodo'])
+                total = int(mask.sum())
+                paginas = max(1, -(-total // tamanho))
+                pagina = c_t3.number_input(f"Página (de {paginas})", min_value=1, max_value=paginas, value=1, step=1)
+
+                ordem = get_ordem_detalhe(versao, ordenacao, df)
+                df_pagina, _ = analise.pagina_detalhe(df, ordem, mask, pagina, tamanho)
+                st.caption(f"Linhas {min(total, (pagina - 1) * tamanho + 1)}–{min(total, pagina * tamanho)} de {total}")
+                st.dataframe(
+                    df_pagina.style.format({'Valor': format_currency}),
+                    use_container_width=True, height=300, hide_index=True
+                )
+
+                # Exportação: os arquivos só são gerados no clique, em lotes
+                df_chart = derivado(versao, ('df_chart', chave_dashboard(selecao)), lambda: analise.montar_df_chart(cubo_da_selecao(versao, get_serie_mensal(versao, df), selecao)))
+                st.markdown("**⬇️ Exportar seleção**")
+                c_e1, c_e2 = st.columns(2)
+                hoje = datetime.now().strftime('%Y%m%d')
+                for formato, (rotulo, mime, extensao) in exportacao.FORMATOS.items():
+                    c_e1.download_button(
+                        f"Lançamentos ({rotulo})", mime=mime, file_name=f"ohana_lancamentos_{hoje}.{extensao}",
+                        data=exportar_sob_demanda(lambda: exportacao.lotes_detalhe(df, ordem[mask[ordem]]), formato, ['Valor'], 'Lançamentos'),
+                        on_click="ignore", use_container_width=True,
+                    )
+                    c_e2.download_button(
+                        f"Resumo por Nº Controle ({rotulo})", mime=mime, file_name=f"ohana_resumo_controles_{hoje}.{extensao}",
+                        data=exportar_sob_demanda(lambda: exportacao.lotes_tabela(exportacao.resumo_por_controle(df_chart)), formato, ['Receita', 'Despesa', 'Resultado'], 'Resumo'),
+                        on_click="ignore", use_container_width=True,
+                    )
+
+def render_dashboard(df, debug_logs, versao_dados):
+    st.markdown(f"""<div style="display: flex; align-items: center; gap: 10px; margin-bottom: 20px;">{ICONS['rocket']}<h1 style="margin: 0; font-size: 28px; font-weight: 700;">Visão Executiva</h1></div>""", unsafe_allow_html=True)
+
+    with instrumentacao.rastrear("dashboard") as rastreio_dashboard:
+        # --- INICIALIZAÇÃO DE ESTADO ---
+        if 'show_taxas' not in st.session_state: st.session_state.show_taxas = False
+        if 'show_das' not in st.session_state: st.session_state.show_das = False
+
+        render_filtros(df, versao_dados)
+        render_kpis(df, versao_dados)
+        render_kpis_extras(df, versao_dados)
+        render_graficos(df, versao_dados)
+        render_detalhe(df, versao_dados)
+
+    with st.expander("🕵️ Ver Diagnóstico"):
+        render_diagnostico(debug_logs, [instrumentacao.ultimo("carga"), rastreio_dashboard], get_relatorio_conciliacao(), get_cache_derivados().estatisticas(), list(get_fonte().historico))
 
 # ==============================================================================
 # 6. POWER BI
 # ==============================================================================
-elif selected == "Power BI Relatório":
+def render_power_bi():
     st.markdown(f"""
     <div style="background-color:{COR_CARD}; border-radius:12px; border:1px solid rgba(235, 82, 131, 0.3); padding:10px;">
         <iframe title="DASHBOARD RESULTADOS FRAME" width="100%" height="700" src="https://app.powerbi.com/reportEmbed?reportId=ff124fd1-8c3c-4a5f-a7dd-ed1f05b078c1&autoAuth=true&ctid=1d90d210-ebe4-4b83-be2c-cdddc540416f" frameborder="0" allowFullScreen="true"></iframe>
     </div>
-    """, unsafe_allow_html=True)
\ No newline at end of file
+    """, unsafe_allow_html=True)
+
+# ==============================================================================
+# 7. EXECUÇÃO
+# ==============================================================================
+def main():
+    st.set_page_config(
+        page_title="Ohana Soluções Financeiras",
+        layout="wide",
+        initial_sidebar_state="expanded",
+        page_icon="📊"
+    )
+    st.markdown(CSS, unsafe_allow_html=True)
+
+    if not check_auth(): st.stop()
+
+    df, debug_logs, versao_dados = load_data()
+    selected = render_sidebar()
+
+    if df.empty:
+        st.error("Nenhum dado financeiro válido foi encontrado.")
+        with st.expander("🕵️ Ver Diagnóstico", expanded=True):
+            render_diagnostico(debug_logs, [instrumentacao.ultimo("carga")])
+        st.stop()
+
+    if selected == "Dashboard":
+        render_dashboard(df, debug_logs, versao_dados)
+    elif selected == "Power BI Relatório":
+        render_power_bi()
+
+# Streamlit executa o script como __main__; importar o módulo (testes, ETL) não abre a página
+if __name__ == "__main__":
+    main()